@@ -2,56 +2,205 @@
 
 import sys
 import os
+import re
+import mmap
+from concurrent.futures import ProcessPoolExecutor
 
-def binary_to_hexdump(binary_file, hexdump_file, offset=0, chunk_size=None):
-    chunk_counter = 1
+# The value part of each output line is precomputed for all 256 byte values and the
+# address part for the 16-bit address space, so that a whole block is formatted with
+# one join and written with one large write
+HEX_VALUES = [f" 0x{value:04X}\n" for value in range(256)]
+HEX_ADDRESSES = [f"0x{address:04X}" for address in range(0x10000)]
+
+# Amount of bytes that are formatted and written at once
+BLOCK_SIZE = 64 * 1024
+
+def format_block(data, address):
+    if address + len(data) <= len(HEX_ADDRESSES):
+        addresses = HEX_ADDRESSES[address:address + len(data)]
+    else:
+        addresses = [f"0x{a:04X}" for a in range(address, address + len(data))]
+    return "".join(map(str.__add__, addresses, map(HEX_VALUES.__getitem__, data)))
+
+def write_chunk(binary_file, hexdump_file_chunk, start, length, offset):
+    with open(binary_file, 'rb') as bin_file:
+        with mmap.mmap(bin_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            with open(hexdump_file_chunk, 'w', buffering=1024 * 1024) as hex_file:
+                for pos in range(start, start + length, BLOCK_SIZE):
+                    block = data[pos:min(pos + BLOCK_SIZE, start + length)]
+                    hex_file.write(format_block(block, offset + pos - start))
+
+def binary_to_hexdump(binary_file, hexdump_file, offset=0, chunk_size=None, jobs=None):
+    # Each chunk file starts again at the given offset: <hexdump_file>.1, <hexdump_file>.2, ...
+    size = os.path.getsize(binary_file)
+    if size == 0:
+        return
+    chunk_size = chunk_size or size
+    chunks = [(f"{hexdump_file}.{n + 1}", start, min(chunk_size, size - start))
+              for n, start in enumerate(range(0, size, chunk_size))]
+
+    if len(chunks) == 1 or jobs == 1:
+        for hexdump_file_chunk, start, length in chunks:
+            write_chunk(binary_file, hexdump_file_chunk, start, length, offset)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(write_chunk, binary_file, hexdump_file_chunk, start, length, offset)
+                   for hexdump_file_chunk, start, length in chunks]
+        for future in futures:
+            future.result()
+
+# Compact mode (-c): instead of one "0xADDR 0xVALUE" line per byte, a keystroke macro
+# for the QNICE monitor is written that can be pasted as-is into the terminal:
+#
+#   MFssssEEEEvvvv      Memory/Fill for each run of at least MIN_FILL_RUN identical bytes
+#   ML aaaavvvv... ^E   Memory/Load for everything else, terminated with CTRL+E
+#
+# The monitor reads exactly four hex nibbles per value, so the "0x" prefixes and the
+# separators are left out. Only within Memory/Load the pairs are broken into lines,
+# which the monitor ignores.
+MIN_FILL_RUN = 3
+MACRO_PAIRS_PER_LINE = 16
+RUN_PATTERN = re.compile(rb"(.)\1{%d,}" % (MIN_FILL_RUN - 1), re.DOTALL)
+
+def compact_records(data, address):
+    # Yields ("fill", start, end, value) and ("load", start, bytes) records
+    pos = 0
+    for run in RUN_PATTERN.finditer(data):
+        if run.start() > pos:
+            yield ("load", address + pos, data[pos:run.start()])
+        yield ("fill", address + run.start(), address + run.end() - 1, data[run.start()])
+        pos = run.end()
+    if pos < len(data):
+        yield ("load", address + pos, data[pos:])
+
+def format_macro(data, address):
+    if address + len(data) > 0x10000:
+        raise ValueError("Compact mode only supports the 16-bit address range 0x0000..0xFFFF")
+    macro = []
+    for record in compact_records(data, address):
+        if record[0] == "fill":
+            macro.append(f"MF{record[1]:04X}{record[2]:04X}{record[3]:04X}")
+        else:
+            pairs = [f"{record[1] + i:04X}{value:04X}" for i, value in enumerate(record[2])]
+            lines = ["".join(pairs[i:i + MACRO_PAIRS_PER_LINE]) for i in range(0, len(pairs), MACRO_PAIRS_PER_LINE)]
+            macro.append("ML" + "\n".join(lines) + "\x05")
+    return "".join(macro)
+
+def binary_to_macro(binary_file, macro_file, offset=0, chunk_size=None):
+    # Chunks are handled like in binary_to_hexdump: <macro_file>.1, <macro_file>.2, ...
     with open(binary_file, 'rb') as bin_file:
-        while True:
-            hexdump_file_chunk = f"{hexdump_file}.{chunk_counter}"
-            with open(hexdump_file_chunk, 'w') as hex_file:
-                address = offset
-                empty_chunk = True
-                for _ in range(chunk_size) if chunk_size else iter(int, 1):
-                    byte = bin_file.read(1)
-                    if not byte:
-                        break
-
-                    empty_chunk = False
-                    hex_byte = int.from_bytes(byte, byteorder='big')
-                    hex_line = f"0x{address:04X} 0x{hex_byte:04X}\n"
-                    hex_file.write(hex_line)
-                    address += 1
-
-            if empty_chunk:
-                os.remove(hexdump_file_chunk)
-
-            if not byte:
-                break
-
-            chunk_counter += 1
+        data = bin_file.read()
+    chunk_size = chunk_size or len(data)
+    for n, start in enumerate(range(0, len(data), chunk_size or 1)):
+        # Formatted before the file is opened, so that no empty file is left behind on errors
+        macro = format_macro(data[start:start + chunk_size], offset)
+        with open(f"{macro_file}.{n + 1}", 'w', newline='') as out_file:
+            out_file.write(macro)
+
+def macro_to_memory(text):
+    # Replays a compact macro the way the monitor would and returns {address: value}
+    memory = {}
+    pos = 0
+    while pos < len(text):
+        if text[pos].isspace():
+            pos += 1
+        elif text.startswith("MF", pos):
+            start, end, value = (int(text[pos + i:pos + i + 4], 16) for i in (2, 6, 10))
+            memory.update(dict.fromkeys(range(start, end + 1), value))
+            pos += 14
+        elif text.startswith("ML", pos):
+            end = text.index("\x05", pos)
+            digits = re.sub(r"\s", "", text[pos + 2:end])
+            for i in range(0, len(digits), 8):
+                memory[int(digits[i:i + 4], 16)] = int(digits[i + 4:i + 8], 16)
+            pos = end + 1
+        else:
+            raise ValueError(f"Unknown monitor command at position {pos}")
+    return memory
+
+def hexdump_files(hexdump_file):
+    # A single hexdump file or all chunk files <hexdump_file>.1, <hexdump_file>.2, ...
+    if os.path.isfile(hexdump_file):
+        return [hexdump_file]
+    files = []
+    while os.path.isfile(f"{hexdump_file}.{len(files) + 1}"):
+        files.append(f"{hexdump_file}.{len(files) + 1}")
+    return files
+
+def hexdump_pairs(text, name):
+    # Yields (address, value) from a hexdump or from a compact macro
+    if text.lstrip().startswith("M"):
+        yield from sorted(macro_to_memory(text).items())
+        return
+    for line_no, line in enumerate(text.splitlines(), 1):
+        fields = line.split()
+        if not fields:
+            continue
+        if len(fields) != 2:
+            raise ValueError(f"{name}:{line_no}: expected '0xADDR 0xVALUE'")
+        yield int(fields[0], 16), int(fields[1], 16)
+
+def hexdump_to_binary(hexdump_file, binary_file, offset=0):
+    # Reverse mode: every chunk is placed behind the previous one and the bytes within
+    # a chunk are placed at their address minus the offset
+    files = hexdump_files(hexdump_file)
+    if not files:
+        raise FileNotFoundError(f"No such hexdump file: {hexdump_file}")
+    with open(binary_file, 'wb') as bin_file:
+        for hexdump_file_chunk in files:
+            chunk = bytearray()
+            with open(hexdump_file_chunk, 'r', newline='') as hex_file:
+                text = hex_file.read()
+            for address, value in hexdump_pairs(text, hexdump_file_chunk):
+                address -= offset
+                if address < 0 or value > 0xFF:
+                    raise ValueError(f"{hexdump_file_chunk}: address 0x{address + offset:04X} or value 0x{value:04X} out of range")
+                if address >= len(chunk):
+                    chunk.extend(bytes(address + 1 - len(chunk)))
+                chunk[address] = value
+            bin_file.write(chunk)
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
+    mode = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] in ("-r", "-c") else None
+    reverse = mode == "-r"
+    args = sys.argv[2:] if mode else sys.argv[1:]
+
+    if len(args) < 2:
         print("Usage: python3 binary_to_hexdump.py <binary_file> <hexdump_file> [offset] [chunk_size]")
+        print("       python3 binary_to_hexdump.py -c <binary_file> <macro_file> [offset] [chunk_size]")
+        print("       python3 binary_to_hexdump.py -r <hexdump_file or macro_file> <binary_file> [offset]")
+        print("-c writes a compact QNICE monitor macro (Memory/Fill and Memory/Load) instead of a hexdump")
         sys.exit(1)
 
-    binary_file = sys.argv[1]
-    hexdump_file = sys.argv[2]
     offset = 0
     chunk_size = None
 
-    if len(sys.argv) >= 4:
+    if len(args) >= 3:
         try:
-            offset = int(sys.argv[3], 16)
+            offset = int(args[2], 16)
         except ValueError:
             print("Error: Invalid offset value. Please provide a hexadecimal value.")
             sys.exit(1)
 
-    if len(sys.argv) == 5:
+    if len(args) == 4 and not reverse:
         try:
-            chunk_size = int(sys.argv[4], 16)
+            chunk_size = int(args[3], 16)
         except ValueError:
             print("Error: Invalid chunk size value. Please provide a hexadecimal value.")
             sys.exit(1)
 
-    binary_to_hexdump(binary_file, hexdump_file, offset, chunk_size)
+    if reverse:
+        try:
+            hexdump_to_binary(args[0], args[1], offset)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    elif mode == "-c":
+        try:
+            binary_to_macro(args[0], args[1], offset, chunk_size)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    else:
+        binary_to_hexdump(args[0], args[1], offset, chunk_size)
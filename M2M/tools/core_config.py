@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+# Reads the constants of CORE/vhdl/config.vhd that the tools need, such as
+# OPTM_SIZE, OPTM_DX, OPTM_DY, DIR_START and CFG_FILE, so that no tool has to
+# hard-code them and get out of sync when the menu changes.
+#
+# Only constants of the types natural, integer, boolean and string whose value is
+# a single literal are read, expressions such as "A & B" are skipped. The result is
+# cached together with the SHA-1 of config.vhd and parsed again when it changed.
+#
+# Usage: core_config.py [--config <config.vhd>] [<constant> ...]
+# Prints the values of the given constants one per line, or all constants.
+
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+
+CONFIG_VHD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "CORE", "vhdl", "config.vhd")
+
+CACHE_FILE = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+                          "m2m_tools", "core_config.json")
+
+# Bump when the parser changes, so that all cached results are parsed again
+PARSER_VERSION = 1
+
+CONSTANT = re.compile(r"^\s*constant\s+(\w+)\s*:\s*(natural|integer|boolean|string)\s*:=\s*"
+                      r"(\"[^\"]*\"|\d+(?:_\d+)*|16#[0-9A-Fa-f_]+#|true|false)\s*;", re.IGNORECASE | re.MULTILINE)
+
+def parse_value(type, literal):
+    type = type.lower()
+    if type == "string":
+        return literal[1:-1]
+    if type == "boolean":
+        return literal.lower() == "true"
+    if literal.startswith("16#"):
+        return int(literal[3:-1].replace("_", ""), 16)
+    return int(literal.replace("_", ""))
+
+def parse_config(text):
+    # Returns {name: value} of all constants with a literal value
+    return {name: parse_value(type, literal) for name, type, literal in CONSTANT.findall(text)}
+
+def load_cache(cache_file):
+    try:
+        with open(cache_file, 'r') as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(cache_file, cache):
+    # Written atomically, several tools might run at the same time
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+
+def load_config(config_file=CONFIG_VHD, cache_file=CACHE_FILE):
+    # Returns {name: value}, raises OSError if config.vhd cannot be read
+    with open(config_file, 'rb') as f:
+        data = f.read()
+    key = f"{PARSER_VERSION}|{hashlib.sha1(data).hexdigest()}"
+    path = os.path.realpath(config_file)
+
+    cache = load_cache(cache_file) if cache_file else {}
+    entry = cache.get(path)
+    if isinstance(entry, dict) and entry.get("key") == key and isinstance(entry.get("constants"), dict):
+        return entry["constants"]
+
+    constants = parse_config(data.decode('latin-1'))
+    if cache_file:
+        cache[path] = {"key": key, "constants": constants}
+        save_cache(cache_file, cache)
+    return constants
+
+def get_constants(names, config_file=CONFIG_VHD, cache_file=CACHE_FILE):
+    # Returns the values of the given constants, raises KeyError for missing ones
+    constants = load_config(config_file, cache_file)
+    missing = [name for name in names if name not in constants]
+    if missing:
+        raise KeyError(f"{', '.join(missing)} not found in {config_file}")
+    return [constants[name] for name in names]
+
+def main():
+    parser = argparse.ArgumentParser(description="Print constants of the core's config.vhd")
+    parser.add_argument("names", nargs="*", help="constants to print (default: all)")
+    parser.add_argument("--config", default=CONFIG_VHD, help="config.vhd to read (default: the one of this core)")
+    args = parser.parse_args()
+
+    try:
+        if args.names:
+            values = get_constants(args.names, args.config)
+            lines = [str(value).lower() if isinstance(value, bool) else str(value) for value in values]
+        else:
+            lines = [f"{name} = {value!r}" for name, value in sorted(load_config(args.config).items())]
+    except OSError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    except KeyError as e:
+        print(f"Error: {e.args[0]}")
+        sys.exit(1)
+    print("\n".join(lines))
+
+if __name__ == "__main__":
+    main()
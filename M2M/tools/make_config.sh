@@ -6,9 +6,10 @@ if [ $# -ne 2 ]; then
 fi
 
 if [ "$2" = "auto" ]; then
-  OPTM_SIZE=$(grep "constant OPTM_SIZE" "../../CORE/vhdl/config.vhd" | sed -E 's/.*:= ([0-9]+).*/\1/')
-  if [ -z "$OPTM_SIZE" ]; then
-    echo "Error: Could not find OPTM_SIZE in ../../CORE/vhdl/config.vhd"
+  # core_config.py reads OPTM_SIZE from CORE/vhdl/config.vhd (and caches it)
+  OPTM_SIZE=$(python3 "$(dirname "$0")/core_config.py" OPTM_SIZE)
+  if ! [[ "$OPTM_SIZE" =~ ^[0-9]+$ ]]; then
+    echo "Error: Could not find OPTM_SIZE in CORE/vhdl/config.vhd"
     exit 1
   fi
 elif [[ "$2" =~ ^[0-9]+$ ]] && [[ $2 -ge 1 ]]; then
@@ -19,11 +20,5 @@ else
   exit 1
 fi
 
-configfile=""
-
-for (( i=1; i<= $OPTM_SIZE; i++ ))
-do
-    configfile="${configfile}\xff"
-done
-
-echo -ne "$configfile" > "$1"
+# OPTM_SIZE bytes of 0xFF
+head -c "$OPTM_SIZE" /dev/zero | LC_ALL=C tr '\000' '\377' > "$1"
@@ -1,67 +1,239 @@
 #!/usr/bin/env python3
 
 # This script can be used to examine strings on the OPTM_HEAP for debugging
-# and development purposes. Make sure that you define the constant OPTM_DX
-# exactly as you have defined it in config.vhd
+# and development purposes. OPTM_DX is read from CORE/vhdl/config.vhd, use
+# --dx if you examine a dump of a core with a different config.vhd
 #
 # Spaces are shown as °
 # Zeros as *
 # Ones as #
 # Twos as ß
 #
-# Constraint: For some reason, pasting large amounts of dumps leads to
-# omitted characters. So cut your dumps into chunks of 16 M/D output lines
-# which are known to work.
+# Usage: optm_heap.py [<capture file> | -]
+#        optm_heap.py --diff <capture file>
+#        optm_heap.py --watch <capture file>
+#
+# Without arguments, the M/D dump is pasted interactively. Constraint: For some
+# reason, pasting large amounts of dumps leads to omitted characters. So cut your
+# dumps into chunks of 16 M/D output lines which are known to work.
+#
+# Given a capture file (e.g. a serial log) or "-" for stdin, dumps of any length
+# are decoded while they are read. Lines that are not M/D output lines, such as
+# prompts and commands in the log, are skipped.
+#
+# --diff compares the consecutive dumps within a capture and only prints the rows
+# and cells that changed, with their addresses. --watch does the same for a
+# growing capture log: the existing content is taken as the baseline and only the
+# newly appended dumps are decoded, until you press CTRL+C.
 #
 # by sy2002 in April 2023
 
-OPTM_DX = 25
-
+import re
 import sys
+import time
+import argparse
+
+import core_config
+
+OPTM_DX = None
+WIDTH = None
 
-WIDTH = OPTM_DX + 2
+# An M/D output line: an address followed by 16-bit words
+DUMP_LINE = re.compile(r"^\s*(?:0x)?[0-9A-Fa-f]+:?((?:\s+[0-9A-Fa-f]{4})+)\s*$")
+
+# Bytes are decoded as Latin-1, which contains ß and °, so the markers can be
+# applied with one precomputed table
+MARKERS = bytes.maketrans(b"\x00\x01\x02 ", "*#ß°".encode("latin-1"))
+
+# Seconds between two checks of a watched capture log
+WATCH_INTERVAL = 0.5
 
 def process_hexdump_line(line):
     hex_values = line.split()[1:]  # Ignore the address part
     low_bytes = [hv[2:] for hv in hex_values]  # Extract the low bytes
     return ''.join(low_bytes)
 
+def dump_lines(lines):
+    # Yields the M/D output lines of a capture and skips everything else
+    for line in lines:
+        if DUMP_LINE.match(line):
+            yield line
+
+def decode_rows(lines, width=None):
+    # Yields (ascii row, hex row) with width bytes each; only one row is buffered
+    width = width or WIDTH
+    hex_str = ''
+    for line in lines:
+        hex_str += process_hexdump_line(line)
+        while len(hex_str) >= width * 2:
+            hex_line, hex_str = hex_str[:width * 2], hex_str[width * 2:]
+            yield hex_to_ascii(hex_line), hex_line
+    if hex_str:
+        yield hex_to_ascii(hex_str), hex_str
+
 def hex_to_ascii(hex_str):
-    ascii_str = ''
-    for i in range(0, len(hex_str), 2):
-        hex_byte = hex_str[i:i+2]
-        char = chr(int(hex_byte, 16))
-        if char == chr(0):
-            char = '*'
-        elif char == chr(1):
-            char = '#'
-        elif char == chr(2):
-            char = 'ß'
-        elif char == ' ':
-            char = '°'
-        ascii_str += char
-    return ascii_str
+    return bytes.fromhex(hex_str).translate(MARKERS).decode("latin-1")
 
-def main():
-    hexdump = []
+def format_row(ascii_line, hex_line):
+    return ascii_line.ljust(WIDTH) + ' ' * 8 + hex_line + '\n'
+
+def parse_dump_line(line):
+    # Returns (address, low bytes) of an M/D output line
+    fields = line.split()
+    return int(fields[0].rstrip(':'), 16), bytes.fromhex(process_hexdump_line(line))
+
+def tail_lines(capture, interval=WATCH_INTERVAL):
+    # Yields the lines appended to an open capture log and None whenever the end was
+    # reached, so that the caller can report what has been read so far
+    partial = ''
+    while True:
+        line = capture.readline()
+        if line.endswith('\n'):
+            yield partial + line
+            partial = ''
+            continue
+        partial += line
+        yield None
+        time.sleep(interval)
+
+class HeapSnapshot:
+    # The last known value of every cell of the dumped region, relative to its lowest
+    # address, with a second bytearray marking the cells that have been dumped so far
+    def __init__(self):
+        self.base = None
+        self.cells = bytearray()
+        self.known = bytearray()
+        self.changes = {}
+
+    def update(self, address, values):
+        if self.base is None:
+            self.base = address
+        if address < self.base:
+            grow = self.base - address
+            self.cells[0:0] = bytes(grow)
+            self.known[0:0] = bytes(grow)
+            self.changes = {offset + grow: change for offset, change in self.changes.items()}
+            self.base = address
+        offset = address - self.base
+        if offset + len(values) > len(self.cells):
+            grow = offset + len(values) - len(self.cells)
+            self.cells.extend(bytes(grow))
+            self.known.extend(bytes(grow))
+        old = self.cells[offset:offset + len(values)]
+        if old != values:
+            for i, (old_value, new_value) in enumerate(zip(old, values)):
+                if old_value != new_value and self.known[offset + i]:
+                    first = self.changes.get(offset + i, (old_value, None))[0]
+                    self.changes[offset + i] = (first, new_value)
+            self.cells[offset:offset + len(values)] = values
+        self.known[offset:offset + len(values)] = b"\x01" * len(values)
+
+    def flush(self):
+        # Returns the report of all changes since the last flush
+        changes = {offset: change for offset, change in self.changes.items() if change[0] != change[1]}
+        self.changes = {}
+        rows = {}
+        for offset in sorted(changes):
+            rows.setdefault(offset // WIDTH, []).append(offset)
+        report = []
+        for row, offsets in rows.items():
+            start = row * WIDTH
+            new = bytes(self.cells[start:start + WIDTH])
+            old = bytearray(new)
+            for offset in offsets:
+                old[offset - start] = changes[offset][0]
+            report.append(f"Row {row:3} @ 0x{self.base + start:04X}  {hex_to_ascii(old.hex()).ljust(WIDTH)}  ->  {hex_to_ascii(new.hex())}\n")
+            for offset in offsets:
+                old_value, new_value = changes[offset]
+                report.append(f"    0x{self.base + offset:04X}: {old_value:02X} {hex_to_ascii(f'{old_value:02X}')} -> "
+                              f"{new_value:02X} {hex_to_ascii(f'{new_value:02X}')}\n")
+        return ''.join(report)
+
+def diff_dumps(lines, snapshot=None):
+    # Yields the report of the changes after each dump; a dump ends when the address
+    # does not increase anymore, at every None within lines and at the end of lines
+    snapshot = snapshot or HeapSnapshot()
+    last_address = None
+    for line in lines:
+        if line is None:
+            yield snapshot.flush()
+        elif DUMP_LINE.match(line):
+            address, values = parse_dump_line(line)
+            if last_address is not None and address <= last_address:
+                yield snapshot.flush()
+            snapshot.update(address, values)
+            last_address = address
+    yield snapshot.flush()
+
+def watch(capture_file):
+    snapshot = HeapSnapshot()
+    with open(capture_file, 'r', errors='replace') as capture:
+        for line in dump_lines(capture):
+            snapshot.update(*parse_dump_line(line))
+        snapshot.flush()
+        print(f"Watching {capture_file}: {sum(snapshot.known)} cells known, press CTRL+C to stop.")
+        for report in diff_dumps(tail_lines(capture), snapshot):
+            sys.stdout.write(report)
+            sys.stdout.flush()
+
+def read_pasted():
     print("Paste the M/D dump of OPTM_HEAP here. To finish, enter an empty line.")
     print("Make sure you are not dumping more than 16 lines at a time.")
     while True:
         line = input()
         if not line:
             break
-        hexdump.append(line)
+        yield line
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode M/D dumps of the OPTM_HEAP")
+    parser.add_argument("capture", nargs="?", help="capture file to decode, - for stdin (default: paste interactively)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--diff", action="store_true", help="only print what changed between the dumps of the capture")
+    mode.add_argument("--watch", action="store_true", help="print what changes in the dumps appended to the capture")
+    parser.add_argument("--dx", type=int, help="OPTM_DX of the dumped core (default: from config.vhd)")
+    args = parser.parse_args()
+
+    global OPTM_DX, WIDTH
+    try:
+        OPTM_DX = args.dx or core_config.get_constants(["OPTM_DX"])[0]
+    except (OSError, KeyError) as e:
+        print(f"Error: {e.args[-1]}, use --dx to specify OPTM_DX")
+        sys.exit(1)
+    WIDTH = OPTM_DX + 2
 
-    processed_lines = [process_hexdump_line(line) for line in hexdump]
-    hex_str = ''.join(processed_lines)
-    ascii_str = hex_to_ascii(hex_str)
+    if args.diff and args.capture is None:
+        parser.error("--diff needs a capture file or - for stdin")
+    if args.watch and args.capture in (None, "-"):
+        parser.error("--watch needs a capture file")
+    if args.watch:
+        try:
+            watch(args.capture)
+        except OSError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        except KeyboardInterrupt:
+            pass
+        return
 
     # Output the ASCII string with a linebreak every WIDTH characters
-    for i in range(0, len(ascii_str), WIDTH):
-        ascii_line = ascii_str[i:i+WIDTH]
-        hex_line = hex_str[i*2:i*2+WIDTH*2]  # Multiply by 2 to account for 2 hex chars per byte
-        padded_ascii_line = ascii_line.ljust(WIDTH)
-        sys.stdout.write(padded_ascii_line + ' ' * 8 + hex_line + '\n')
+    if args.capture is None:
+        lines = read_pasted()
+    elif args.capture == "-":
+        lines = dump_lines(sys.stdin)
+    else:
+        try:
+            capture = open(args.capture, 'r', errors='replace')
+        except OSError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        lines = dump_lines(capture)
+    if args.diff:
+        for report in diff_dumps(lines):
+            sys.stdout.write(report)
+        return
+    for ascii_line, hex_line in decode_rows(lines):
+        sys.stdout.write(format_row(ascii_line, hex_line))
 
 if __name__ == "__main__":
     main()
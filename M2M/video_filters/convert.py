@@ -1,59 +1,262 @@
 #!/usr/bin/env python3
 
-import math
+# Converts MiSTer filter coefficient files into the formats used by M2M:
+#
+#   .out    "0xADDR 0xVALUE" lines that can be pasted into the QNICE monitor
+#   .asm    .DW statements for the QNICE firmware
+#   bank    one binary filter bank image with an index of all filters (--bank)
+#
+# The parameters of every filter are read from the manifest (filters.manifest) of
+# its folder. Targets are converted in parallel and a target is only regenerated
+# when the hash of its input or its parameters changed since the last run.
+#
+# Usage: convert.py [--manifest <file>] [--jobs <n>] [--force] [--bank <file>] [<folder or filter file> ...]
+# Without arguments, the filters of the folder of this script are converted.
+
+import os
+import sys
+import json
+import struct
+from array import array
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 MODE_OUT = 1
 MODE_ASM = 2
 
+MODE_EXTENSIONS = {MODE_OUT: ".out", MODE_ASM: ".asm"}
+
+MANIFEST_FILE = "filters.manifest"
+CACHE_FILE = ".convert_cache.json"
+
+# Bump when the generated output changes, so that all cached targets are regenerated
+CONVERTER_VERSION = 1
+
 def tohex(val, nbits):
     return format((val + (1 << nbits)) % (1 << nbits), '04X')
 
-def convert_file(mode, file_in, file_out, address, bits, skip_header_lines, skip_lines, shift_right, shift_left):
+# Parse once, emit many: a coefficient file is parsed once into a compact integer
+# array of the phases that are kept. Shifts and bit masking are applied to the whole
+# array at once and every output format is rendered from that single array.
+
+def parse_filter(file_in, skip_header_lines, skip_lines):
+    # Returns (header lines, coefficients of every skip_lines-th phase)
     with open(file_in, 'r') as input:
+        lines = input.readlines()
+    phases = [line for line in lines[skip_header_lines:] if line.count(',') == 3]
+    coefficients = array('i', map(int, ','.join(phases[::skip_lines]).split(','))) if phases else array('i')
+    return lines[:skip_header_lines], coefficients
+
+def transform(coefficients, bits, shift_right, shift_left):
+    # floor(e / 2**shift_right) * 2**shift_left as two's complement with the given width
+    mask = (1 << bits) - 1
+    return array('L', [((e >> shift_right) << shift_left) & mask for e in coefficients])
+
+def render_out(values, address):
+    addresses = [(address + i) & 0xFFFF for i in range(len(values))]
+    return ''.join(map('0x{:04X} 0x{:04X}\n'.format, addresses, values))
+
+def render_asm(values, header, name):
+    label = (os.path.splitext(os.path.basename(name))[0] + '\n').upper()
+    rows = map('.DW 0x{:04X}, 0x{:04X}, 0x{:04X}, 0x{:04X}\n'.format, *[iter(values)] * 4)
+    return ''.join(['; ' + line for line in header] + [label] + list(rows))
+
+def render(mode, values, header, file_in, address):
+    return render_out(values, address) if mode == MODE_OUT else render_asm(values, header, file_in)
+
+def convert_filter(file_in, outputs, address, bits, skip_header_lines, skip_lines, shift_right, shift_left):
+    # outputs is a list of (mode, file_out)
+    header, coefficients = parse_filter(file_in, skip_header_lines, skip_lines)
+    values = transform(coefficients, bits, shift_right, shift_left)
+    for mode, file_out in outputs:
         with open(file_out, 'w') as output:
-            element_counter = 0;    
-            lines = input.readlines()
-
-            if mode == MODE_ASM:
-                for i in range (0, skip_header_lines):
-                    output.write('; ' + lines[i])
-                output.write((file_in[:len(file_in)-4]+'\n').upper())
-
-            lines = lines[skip_header_lines:]
-            skip_counter = 0
-
-            for line in lines:
-                elements = line.split(',')
-                if len(elements) == 4:
-                    if skip_counter % skip_lines == 0:
-                        int_elements = list(map(int, elements))
-                        if mode == MODE_OUT:
-                            for e in int_elements:
-                                output.write('0x' + tohex(address + element_counter, 16) + ' ')
-                                output.write('0x' + tohex(math.floor(e / 2**shift_right) * 2**shift_left, bits) + '\n')
-                                element_counter = element_counter + 1
-                        else:
-                            output.write('.DW ')
-                            elm_in_line = 1
-                            for e in int_elements:
-                                output.write('0x' + tohex(math.floor(e / 2**shift_right) * 2**shift_left, bits))
-                                if elm_in_line != 4:
-                                    output.write(', ')
-                                    elm_in_line = elm_in_line + 1
-                                else:
-                                    output.write('\n')
-                                    
-                    skip_counter = skip_counter + 1
-
-convert_file(MODE_OUT, 'lanczos2_12.txt',     'lanczos2_12.out'    , 0x7000, 10, 6, 4, 0, 0)
-convert_file(MODE_ASM, 'lanczos2_12.txt',     'lanczos2_12.asm'    , 0x7000, 10, 6, 4, 0, 0)
-convert_file(MODE_OUT, 'Scanlines_80.txt',    'Scanlines_80.out'   , 0x7100, 10, 7, 1, 0, 1)
-convert_file(MODE_ASM, 'Scanlines_80.txt',    'Scanlines_80.asm'   , 0x7100, 10, 7, 1, 0, 1)
-convert_file(MODE_OUT, 'Scan_Br_105_80.txt',  'Scan_Br_105_80.out' , 0x7100, 10, 7, 1, 0, 1)
-convert_file(MODE_ASM, 'Scan_Br_105_80.txt',  'Scan_Br_105_80.asm' , 0x7100, 10, 7, 1, 0, 1)
-convert_file(MODE_OUT, 'Scan_Br_110_80.txt',  'Scan_Br_110_80.out' , 0x7100, 10, 7, 1, 0, 1)
-convert_file(MODE_ASM, 'Scan_Br_110_80.txt',  'Scan_Br_110_80.asm' , 0x7100, 10, 7, 1, 0, 1)
-convert_file(MODE_OUT, 'Scan_Br_115_80.txt',  'Scan_Br_115_80.out' , 0x7100, 10, 7, 1, 0, 1)
-convert_file(MODE_ASM, 'Scan_Br_115_80.txt',  'Scan_Br_115_80.asm' , 0x7100, 10, 7, 1, 0, 1)
-convert_file(MODE_OUT, 'Scan_Br_120_80.txt',  'Scan_Br_120_80.out' , 0x7100, 10, 7, 1, 0, 1)
-convert_file(MODE_ASM, 'Scan_Br_120_80.txt',  'Scan_Br_120_80.asm' , 0x7100, 10, 7, 1, 0, 1)
+            output.write(render(mode, values, header, file_in, address))
+
+def convert_file(mode, file_in, file_out, address, bits, skip_header_lines, skip_lines, shift_right, shift_left):
+    convert_filter(file_in, [(mode, file_out)], address, bits, skip_header_lines, skip_lines, shift_right, shift_left)
+
+# Filter bank image (--bank): all values are little-endian 16-bit words and all
+# offsets and lengths are counted in words, so that the firmware can locate a filter
+# by its index and copy it into the ascal polyphase RAM without parsing any text.
+#
+#   header  magic "FB", version, amount of filters
+#   index   per filter: name (16 ASCII characters, zero padded), type (0 = horizontal,
+#           1 = vertical), phase count, offset from the start of the image, length
+#   data    the values of all filters, in the order of the index
+BANK_MAGIC = b"FB"
+BANK_VERSION = 1
+BANK_NAME_LEN = 16
+BANK_HEADER = struct.Struct("<2sHH")
+BANK_ENTRY = struct.Struct(f"<{BANK_NAME_LEN}sHHHH")
+BANK_HORIZONTAL = 0
+BANK_VERTICAL = 1
+
+# The manifest addresses are the QNICE view of the polyphase RAM: the horizontal
+# filter starts at 0x7000 and the vertical filter at 0x7100 (M2M$ASCAL_PP_VERT)
+ASCAL_PP_VERT = 0x0100
+
+def filter_type(address):
+    return BANK_VERTICAL if address & ASCAL_PP_VERT else BANK_HORIZONTAL
+
+def pack_bank(filters):
+    # filters is a list of (name, type, values), every phase consists of four values
+    data_start = (BANK_HEADER.size + len(filters) * BANK_ENTRY.size) // 2
+    index = []
+    offset = data_start
+    for name, type, values in filters:
+        encoded = name.encode('ascii')
+        if len(encoded) > BANK_NAME_LEN:
+            raise ValueError(f"Filter name {name} is longer than {BANK_NAME_LEN} characters")
+        index.append(BANK_ENTRY.pack(encoded, type, len(values) // 4, offset, len(values)))
+        offset += len(values)
+    if offset > 0x10000:
+        raise ValueError("Filter bank does not fit into 64k words")
+    words = array('H', [value for name, type, values in filters for value in values])
+    if sys.byteorder != 'little':
+        words.byteswap()
+    return BANK_HEADER.pack(BANK_MAGIC, BANK_VERSION, len(filters)) + b''.join(index) + words.tobytes()
+
+def read_bank(image):
+    # Returns a list of (name, type, values), the inverse of pack_bank
+    magic, version, count = BANK_HEADER.unpack_from(image)
+    if magic != BANK_MAGIC or version != BANK_VERSION:
+        raise ValueError("Not a filter bank image")
+    words = array('H', image[:len(image) & ~1])
+    if sys.byteorder != 'little':
+        words.byteswap()
+    filters = []
+    for n in range(count):
+        name, type, phases, offset, length = BANK_ENTRY.unpack_from(image, BANK_HEADER.size + n * BANK_ENTRY.size)
+        filters.append((name.rstrip(b'\0').decode('ascii'), type, words[offset:offset + length]))
+    return filters
+
+def build_bank(filters, bank_file):
+    # filters is a dict {file_in: params} in the order of the bank index
+    entries = []
+    for file_in, (address, bits, skip_header_lines, skip_lines, shift_right, shift_left) in filters.items():
+        header, coefficients = parse_filter(file_in, skip_header_lines, skip_lines)
+        name = os.path.splitext(os.path.basename(file_in))[0].upper()
+        entries.append((name, filter_type(address), transform(coefficients, bits, shift_right, shift_left)))
+    with open(bank_file, 'wb') as f:
+        f.write(pack_bank(entries))
+    return entries
+
+def read_manifest(manifest_file):
+    # One filter per line: <input> <address> <bits> <header lines> <skip> <shift right> <shift left>
+    # Numbers may be given in decimal or with a 0x prefix, # starts a comment
+    filters = {}
+    base = os.path.dirname(os.path.abspath(manifest_file))
+    with open(manifest_file, 'r') as f:
+        for line_no, line in enumerate(f, 1):
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) != 7:
+                raise ValueError(f"{manifest_file}:{line_no}: expected 7 fields, found {len(fields)}")
+            try:
+                params = [int(field, 0) for field in fields[1:]]
+            except ValueError:
+                raise ValueError(f"{manifest_file}:{line_no}: parameters need to be numbers")
+            filters[os.path.join(base, fields[0])] = params
+    return filters
+
+def collect_jobs(sources, manifest_file=None):
+    # Returns a list of (mode, file_in, file_out, params)
+    manifests = {}
+    jobs = []
+    for source in sources:
+        folder = source if os.path.isdir(source) else os.path.dirname(os.path.abspath(source))
+        manifest = manifest_file or os.path.join(folder, MANIFEST_FILE)
+        if manifest not in manifests:
+            manifests[manifest] = read_manifest(manifest)
+        filters = manifests[manifest]
+        if os.path.isdir(source):
+            selected = [f for f in filters if os.path.dirname(f) == os.path.abspath(source)]
+        else:
+            if os.path.abspath(source) not in filters:
+                raise ValueError(f"{source} is not listed in {manifest}")
+            selected = [os.path.abspath(source)]
+        for file_in in selected:
+            for mode, extension in MODE_EXTENSIONS.items():
+                jobs.append((mode, file_in, os.path.splitext(file_in)[0] + extension, filters[file_in]))
+    return jobs
+
+def job_key(mode, file_in, params):
+    with open(file_in, 'rb') as f:
+        input_hash = hashlib.sha1(f.read()).hexdigest()
+    return f"{CONVERTER_VERSION}|{mode}|{input_hash}|{','.join(map(str, params))}"
+
+def load_cache(folder):
+    try:
+        with open(os.path.join(folder, CACHE_FILE), 'r') as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(folder, cache):
+    with open(os.path.join(folder, CACHE_FILE), 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+
+def run_job(job):
+    # All targets of one filter are rendered from a single parse
+    file_in, params, outputs = job
+    convert_filter(file_in, outputs, *params)
+    return [file_out for mode, file_out in outputs]
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert MiSTer filter coefficients for M2M")
+    parser.add_argument("sources", nargs="*", help="filter folders or single filter files (default: folder of this script)")
+    parser.add_argument("--manifest", help=f"manifest to use instead of the {MANIFEST_FILE} of each folder")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="amount of parallel worker processes")
+    parser.add_argument("--force", action="store_true", help="convert all filters even if they are up to date")
+    parser.add_argument("--bank", help="additionally pack all selected filters into this binary filter bank image")
+    args = parser.parse_args()
+
+    try:
+        jobs = collect_jobs(args.sources or [os.path.dirname(os.path.abspath(__file__))], args.manifest)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    # The cache lives next to the targets and maps each target to the key it was built from
+    caches = {}
+    todo = []
+    for job in jobs:
+        mode, file_in, file_out, params = job
+        folder = os.path.dirname(file_out)
+        cache = caches.setdefault(folder, load_cache(folder))
+        key = job_key(mode, file_in, params)
+        if args.force or cache.get(os.path.basename(file_out)) != key or not os.path.isfile(file_out):
+            todo.append((job, key))
+
+    if todo:
+        # Group the targets by filter so that every input is parsed only once
+        filter_jobs = {}
+        for (mode, file_in, file_out, params), key in todo:
+            filter_jobs.setdefault((file_in, tuple(params)), []).append((mode, file_out, key))
+        work = [(file_in, params, [(mode, file_out) for mode, file_out, key in outputs])
+                for (file_in, params), outputs in filter_jobs.items()]
+        with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+            for job, files_out in zip(work, pool.map(run_job, work)):
+                for (mode, file_out, key) in filter_jobs[(job[0], job[1])]:
+                    print(f"Converted {os.path.basename(job[0])} to {os.path.basename(file_out)}")
+                    caches[os.path.dirname(file_out)][os.path.basename(file_out)] = key
+        for folder, cache in caches.items():
+            save_cache(folder, cache)
+    print(f"{len(todo)} of {len(jobs)} targets converted, {len(jobs) - len(todo)} up to date.")
+
+    if args.bank:
+        filters = {file_in: params for mode, file_in, file_out, params in jobs}
+        try:
+            entries = build_bank(filters, args.bank)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Packed {len(entries)} filters into {args.bank}:")
+        for n, (name, type, values) in enumerate(entries):
+            print(f"  {n:2}  {name:{BANK_NAME_LEN}}  {'vertical' if type == BANK_VERTICAL else 'horizontal':10}  {len(values) // 4:3} phases")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# Helpers shared by the benchmarks: synthetic data, timing, the JSON results file
+# and the comparison against the results of an earlier run (--compare)
+
+import json
+import time
+import random
+import platform
+
+def synthetic_bytes(seed, size, fills=(0x00, 0xff)):
+    # Deterministic per seed. Half noise and half runs of the fill values gives
+    # compression ratios like those of real ROMs and RAM images.
+    rnd = random.Random(seed)
+    data = bytearray()
+    while len(data) < size:
+        if rnd.random() < 0.5:
+            data += bytes(rnd.getrandbits(8) for _ in range(64))
+        else:
+            data += bytes([rnd.choice(fills)]) * 64
+    return bytes(data[:size])
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+def write_results(output_file, repeat, results):
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "results": results,
+    }
+    with open(output_file, "w") as f:
+        json.dump(report, f, indent=1)
+
+def compare_results(results, old_file, key, label, seconds):
+    # key returns the tuple that identifies the configuration of a result, label
+    # formats that tuple and seconds returns {name: seconds} of a result; an empty
+    # name is printed as the change only
+    with open(old_file, "r") as f:
+        old = {key(r): r for r in json.load(f)["results"]}
+    print(f"\nChange against {old_file} (negative is faster):")
+    for result in results:
+        before = old.get(key(result))
+        if before is None:
+            continue
+        changes = []
+        for name, current in seconds(result).items():
+            previous = seconds(before).get(name)
+            if previous:
+                changes.append(f"{name + ' ' if name else ''}{(current - previous) / previous * 100:+6.1f}%")
+        print(f"{label(key(result))}  " + "  ".join(changes))
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+# Benchmark for xevious_rom_installer.py that does not need real ROM dumps
+#
+# Synthetic romsets with the file lists and sizes of every supported variant are
+# generated into a temporary directory and the installer's checksum tables are
+# patched in memory to match the fake content. The extract, verify, assemble and
+# write phases are timed separately for several compression levels and archive
+# sizes (the "padding" adds unrelated entries, like in a merged MAME set).
+#
+# Usage: bench_installer.py [--repeat <n>] [--output <results.json>] [--compare <old.json>]
+
+import os
+import sys
+import random
+import hashlib
+import zipfile
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import xevious_rom_installer as installer
+from bench_common import synthetic_bytes, timed, write_results, compare_results
+
+# name: (compression, compresslevel)
+COMPRESSIONS = {
+    "stored":    (zipfile.ZIP_STORED,   None),
+    "deflate-1": (zipfile.ZIP_DEFLATED, 1),
+    "deflate-6": (zipfile.ZIP_DEFLATED, 6),
+    "deflate-9": (zipfile.ZIP_DEFLATED, 9),
+}
+
+# Size of the unrelated extra entries in KiB
+PADDINGS = [0, 1024, 8192]
+
+PHASES = ["extract", "verify", "assemble", "write"]
+
+def synthetic_rom(part, size):
+    # Seeded with the part name, so that the parts shared between the variants are identical
+    return synthetic_bytes(part, size)
+
+def patch_checksums(roms):
+    for files, checksums, layout in installer.VARIANTS.values():
+        for part in files:
+            checksums[part] = hashlib.sha1(roms[part]).hexdigest()
+    installer.SHA1_INDEX.clear()
+    installer.SHA1_INDEX.update(installer.build_sha1_index(installer.VARIANTS))
+
+def make_romset(path, variant, roms, compression, padding_kib):
+    files = installer.VARIANTS[variant][0]
+    compress_type, level = COMPRESSIONS[compression]
+    with zipfile.ZipFile(path, "w", compress_type, compresslevel=level) as zip_ref:
+        for part in files:
+            zip_ref.writestr(part, roms[part])
+        rnd = random.Random(padding_kib)
+        for i in range(padding_kib // 256):
+            zip_ref.writestr(f"padding/{i:04d}.bin", rnd.randbytes(256 * 1024) if hasattr(rnd, "randbytes") else os.urandom(256 * 1024))
+
+def run_once(zip_path, variant, output_folder):
+    files, checksums, layout = installer.VARIANTS[variant]
+    timings = {}
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        timings["extract"], _ = timed(lambda: [zip_ref.read(part) for part in files])
+        timings["verify"], roms = timed(installer.verify_checksums, zip_ref, checksums, files)
+
+    def assemble():
+        plan = installer.compile_plan(layout, roms)
+        for section, output_file, message, segments in plan:
+            installer.output_digest(segments, roms)
+        return plan
+    timings["assemble"], plan = timed(assemble)
+
+    def write():
+        writer = installer.StagedWriter(output_folder)
+        for section, output_file, message, segments in plan:
+            writer.stage(output_file, segments, roms)
+        return writer.commit()
+    timings["write"], _ = timed(write)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Xevious ROM installer with synthetic romsets")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per configuration, the median is reported")
+    parser.add_argument("--output", default="bench_installer.json", help="JSON file for the results")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    roms = {part: synthetic_rom(part, size) for part, size in installer.ROM_SIZES.items()}
+    patch_checksums(roms)
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for variant in installer.VARIANTS:
+            for compression in COMPRESSIONS:
+                for padding_kib in PADDINGS:
+                    zip_path = os.path.join(temp_dir, f"{variant}-{compression}-{padding_kib}.zip")
+                    make_romset(zip_path, variant, roms, compression, padding_kib)
+                    output_folder = os.path.join(temp_dir, "out")
+                    os.makedirs(output_folder, exist_ok=True)
+                    runs = [run_once(zip_path, variant, output_folder) for _ in range(max(1, args.repeat))]
+                    result = {
+                        "variant": variant,
+                        "compression": compression,
+                        "padding_kib": padding_kib,
+                        "zip_bytes": os.path.getsize(zip_path),
+                        "seconds": {phase: statistics.median(run[phase] for run in runs) for phase in PHASES},
+                    }
+                    results.append(result)
+                    print(f"{variant:<10} {compression:<10} {padding_kib:>5} KiB  " +
+                          "  ".join(f"{phase} {result['seconds'][phase] * 1000:8.3f} ms" for phase in PHASES))
+                    os.remove(zip_path)
+
+    write_results(args.output, args.repeat, results)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        compare_results(results, args.compare,
+                        key=lambda r: (r["variant"], r["compression"], r["padding_kib"]),
+                        label=lambda key: f"{key[0]:<10} {key[1]:<10} {key[2]:>5} KiB",
+                        seconds=lambda r: {phase: r["seconds"].get(phase) for phase in PHASES})
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+# Benchmark for the M2M host tools: convert.py, bin2qnice.py and optm_heap.py
+#
+# Synthetic filter coefficient files, binaries and M/D dumps of several sizes are
+# generated into a temporary directory. The core function of every tool is timed
+# against a reference implementation, which is the original per-element algorithm
+# of the tool, and the outputs of both are checked to be identical byte for byte.
+#
+# Usage: bench_m2m_tools.py [--repeat <n>] [--quick] [--output <results.json>] [--compare <old.json>]
+
+import os
+import sys
+import math
+import random
+import argparse
+import tempfile
+import statistics
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "M2M", "video_filters"))
+sys.path.insert(0, os.path.join(ROOT, "M2M", "tools"))
+import convert
+import bin2qnice
+import optm_heap
+import core_config
+from bench_common import synthetic_bytes, timed, write_results, compare_results
+
+# Input sizes per tool: phases of a filter, bytes of a binary, cells of an M/D dump
+SIZES = {
+    "convert":   [256, 4096, 65536],
+    "bin2qnice": [4 * 1024, 64 * 1024, 1024 * 1024],
+    "optm_heap": [1024, 16 * 1024, 256 * 1024],
+}
+QUICK_SIZES = {tool: sizes[:2] for tool, sizes in SIZES.items()}
+
+# Parameters of the scanline filters: address, bits, header lines, skip, shift right, shift left
+FILTER_PARAMS = (0x7100, 10, 7, 1, 0, 1)
+
+# Reference implementations: the original algorithms of the tools
+
+def reference_convert_file(mode, file_in, file_out, address, bits, skip_header_lines, skip_lines, shift_right, shift_left):
+    def tohex(val, nbits):
+        return format((val + (1 << nbits)) % (1 << nbits), '04X')
+    with open(file_in, 'r') as input:
+        with open(file_out, 'w') as output:
+            element_counter = 0
+            lines = input.readlines()
+            if mode == convert.MODE_ASM:
+                for i in range(0, skip_header_lines):
+                    output.write('; ' + lines[i])
+                output.write((file_in[:len(file_in) - 4] + '\n').upper())
+            skip_counter = 0
+            for line in lines[skip_header_lines:]:
+                elements = line.split(',')
+                if len(elements) == 4:
+                    if skip_counter % skip_lines == 0:
+                        int_elements = list(map(int, elements))
+                        if mode == convert.MODE_OUT:
+                            for e in int_elements:
+                                output.write('0x' + tohex(address + element_counter, 16) + ' ')
+                                output.write('0x' + tohex(math.floor(e / 2**shift_right) * 2**shift_left, bits) + '\n')
+                                element_counter = element_counter + 1
+                        else:
+                            output.write('.DW ' + ', '.join('0x' + tohex(math.floor(e / 2**shift_right) * 2**shift_left, bits)
+                                                            for e in int_elements) + '\n')
+                    skip_counter = skip_counter + 1
+
+def reference_binary_to_hexdump(binary_file, hexdump_file, offset=0):
+    with open(binary_file, 'rb') as bin_file:
+        with open(f"{hexdump_file}.1", 'w') as hex_file:
+            address = offset
+            while True:
+                byte = bin_file.read(1)
+                if not byte:
+                    break
+                hex_file.write(f"0x{address:04X} 0x{int.from_bytes(byte, byteorder='big'):04X}\n")
+                address += 1
+
+def reference_optm_heap(lines, width):
+    hex_str = ''.join(''.join(hv[2:] for hv in line.split()[1:]) for line in lines)
+    ascii_str = ''
+    for i in range(0, len(hex_str), 2):
+        char = chr(int(hex_str[i:i + 2], 16))
+        if char == chr(0):
+            char = '*'
+        elif char == chr(1):
+            char = '#'
+        elif char == chr(2):
+            char = 'ß'
+        elif char == ' ':
+            char = '°'
+        ascii_str += char
+    output = []
+    for i in range(0, len(ascii_str), width):
+        output.append(ascii_str[i:i + width].ljust(width) + ' ' * 8 + hex_str[i * 2:i * 2 + width * 2] + '\n')
+    return ''.join(output)
+
+# Synthetic inputs
+
+def synthetic_filter(path, phases):
+    rnd = random.Random(phases)
+    with open(path, "w") as f:
+        f.write("10bit\n# Synthetic filter\n#\n#\n#\n\n# Coefficients\n")
+        for _ in range(phases):
+            f.write(", ".join(f"{rnd.randint(-512, 511):4}" for _ in range(4)) + "\n")
+
+def synthetic_binary(path, size):
+    with open(path, "wb") as f:
+        f.write(synthetic_bytes(size, size, fills=(0x00, 0x20, 0xff)))
+
+def synthetic_dump(cells):
+    # M/D output lines with 8 words each, the low bytes mostly text and markers
+    rnd = random.Random(cells)
+    values = [rnd.choice(b"\x00\x01\x02  ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnop<>") for _ in range(cells)]
+    return [f"{0x8000 + pos:04X}: " + " ".join(f"00{value:02X}" for value in values[pos:pos + 8])
+            for pos in range(0, cells, 8)]
+
+# Benchmarks: each one returns {"current": seconds, "reference": seconds, "bytes": output bytes, "identical": bool}
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def bench_convert(temp_dir, phases):
+    # Relative file names, the reference uses the path of the input as label
+    os.chdir(temp_dir)
+    synthetic_filter("filter.txt", phases)
+    current = reference = 0.0
+    identical = True
+    size = 0
+    for mode in (convert.MODE_OUT, convert.MODE_ASM):
+        seconds, _ = timed(convert.convert_file, mode, "filter.txt", "current.txt", *FILTER_PARAMS)
+        current += seconds
+        seconds, _ = timed(reference_convert_file, mode, "filter.txt", "reference.txt", *FILTER_PARAMS)
+        reference += seconds
+        identical = identical and read_bytes("current.txt") == read_bytes("reference.txt")
+        size += os.path.getsize("current.txt")
+    return {"current": current, "reference": reference, "bytes": size, "identical": identical}
+
+def bench_bin2qnice(temp_dir, size):
+    binary_file = os.path.join(temp_dir, "data.bin")
+    synthetic_binary(binary_file, size)
+    current, _ = timed(bin2qnice.binary_to_hexdump, binary_file, os.path.join(temp_dir, "current"), 0x8000, None, 1)
+    reference, _ = timed(reference_binary_to_hexdump, binary_file, os.path.join(temp_dir, "reference"), 0x8000)
+    output = read_bytes(os.path.join(temp_dir, "current.1"))
+    return {"current": current, "reference": reference, "bytes": len(output),
+            "identical": output == read_bytes(os.path.join(temp_dir, "reference.1"))}
+
+def bench_optm_heap(temp_dir, cells):
+    lines = synthetic_dump(cells)
+    def current_decode():
+        return "".join(optm_heap.format_row(ascii_line, hex_line) for ascii_line, hex_line in optm_heap.decode_rows(lines))
+    current, output = timed(current_decode)
+    reference, expected = timed(reference_optm_heap, lines, optm_heap.WIDTH)
+    return {"current": current, "reference": reference, "bytes": len(output.encode()), "identical": output == expected}
+
+BENCHMARKS = {
+    "convert":   bench_convert,
+    "bin2qnice": bench_bin2qnice,
+    "optm_heap": bench_optm_heap,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the M2M host tools with synthetic inputs")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per configuration, the median is reported")
+    parser.add_argument("--quick", action="store_true", help="skip the largest input sizes")
+    parser.add_argument("--output", default="bench_m2m_tools.json", help="JSON file for the results")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    args = parser.parse_args()
+    output_file = os.path.abspath(args.output)
+
+    # optm_heap.py takes OPTM_DX from config.vhd at startup
+    optm_heap.OPTM_DX = core_config.get_constants(["OPTM_DX"])[0]
+    optm_heap.WIDTH = optm_heap.OPTM_DX + 2
+
+    results = []
+    mismatches = 0
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        try:
+            for tool, benchmark in BENCHMARKS.items():
+                for size in (QUICK_SIZES if args.quick else SIZES)[tool]:
+                    runs = [benchmark(temp_dir, size) for _ in range(max(1, args.repeat))]
+                    result = {
+                        "tool": tool,
+                        "size": size,
+                        "bytes_out": runs[0]["bytes"],
+                        "identical": all(run["identical"] for run in runs),
+                        "seconds": {impl: statistics.median(run[impl] for run in runs) for impl in ("current", "reference")},
+                    }
+                    result["mb_per_s"] = round(result["bytes_out"] / max(result["seconds"]["current"], 1e-9) / 1e6, 3)
+                    results.append(result)
+                    mismatches += not result["identical"]
+                    print(f"{tool:<10} {size:>8}  current {result['seconds']['current'] * 1000:9.3f} ms  "
+                          f"reference {result['seconds']['reference'] * 1000:9.3f} ms  "
+                          f"{result['mb_per_s']:8.2f} MB/s  {'identical' if result['identical'] else 'OUTPUT DIFFERS'}")
+        finally:
+            os.chdir(cwd)
+
+    write_results(output_file, args.repeat, results)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        compare_results(results, args.compare,
+                        key=lambda r: (r["tool"], r["size"]),
+                        label=lambda key: f"{key[0]:<10} {key[1]:>8}",
+                        seconds=lambda r: {"": r["seconds"].get("current")})
+
+    if mismatches:
+        print(f"\nError: {mismatches} configurations produced output that differs from the reference")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,20 @@
 #!/usr/bin/env python3
 import os
+import re
 import sys
+import zlib
 import zipfile
-import tempfile
-import shutil
 import hashlib
+import json
+import argparse
+from collections import namedtuple
+import io
+import time
+import contextlib
+import asyncio
+import struct
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 
 # Xevious Atari Namco PCB
@@ -175,254 +185,1827 @@ ATARI2_CHK = {
     "54xx.bin": "01bdf984a49e8d0cc8761b2cc162fd6434d5afbe"
 }
 
-def calculate_sha1(file_path):
+# Output layouts
+#
+# Every output file is an ordered list of source ranges (part, start, end) where end=None
+# means "up to the end of the part". The sections only structure the progress output.
+# The CPU ROMs are the only difference between the variants.
+
+def make_layout(rom1_parts, rom2_parts):
+    def whole(*parts):
+        return [(part, 0, None) for part in parts]
+    def copy(*parts):
+        return [(part, whole(part)) for part in parts]
+    return [
+        ("Preparing ROM 1",              [("rom1.rom", whole(*rom1_parts))]),
+        ("Preparing ROM 2",              [("rom2.rom", whole(*rom2_parts))]),
+        ("Copying ROM 3",                copy("xvi_7.2c")),
+        ("Copying foreground tiles",     copy("xvi_12.3b")),
+        ("Copying background tiles",     copy("xvi_13.3c", "xvi_14.3d")),
+        ("Preparing sprites",            copy("xvi_15.4m", "xvi_17.4p", "xvi_16.4n") + [
+                                            ("xvi_18.4r_1", [("xvi_18.4r", 0, 4096)]),
+                                            ("xvi_18.4r_2", [("xvi_18.4r", 4096, 8192)])]),
+        ("Copying background tile maps", copy("xvi_9.2a", "xvi_10.2b", "xvi_11.2c")),
+        ("Copying MCUs",                 copy("50xx.bin", "51xx.bin", "54xx.bin")),
+    ]
+
+NAMCO_LAYOUT  = make_layout(NAMCO_FILES[0:4],  NAMCO_FILES[4:6])
+ANAMCO_LAYOUT = make_layout(ANAMCO_FILES[0:4], ANAMCO_FILES[4:6])
+SUPERX_LAYOUT = make_layout(SUPERX_FILES[0:4], SUPERX_FILES[4:6])
+ATARI2_LAYOUT = make_layout(ATARI2_FILES[0:2], ATARI2_FILES[2:3])
+
+# MAME romset name: (files, checksums, layout)
+VARIANTS = {
+    "xevious":   (NAMCO_FILES,  NAMCO_CHK,  NAMCO_LAYOUT),     # Xevious (Namco)                    (Namco, 1982)
+    "xeviousc":  (ANAMCO_FILES, ANAMCO_CHK, ANAMCO_LAYOUT),    # Xevious (Atari, Namco PCB)         (Namco (Atari license), 1982)
+    "sxeviousj": (SUPERX_FILES, SUPERX_CHK, SUPERX_LAYOUT),    # Super Xevious (Japan)              (Namco, 1984)
+    "xeviousa":  (ATARI2_FILES, ATARI2_CHK, ATARI2_LAYOUT),    # Xevious (Atari, harder)            (Namco (Atari license), 1982)
+}
+
+def build_sha1_index(variants):
+    # SHA-1 -> [(variant, part), ...]: most parts are shared between the variants
+    index = {}
+    for variant, (files, checksums, layout) in variants.items():
+        for part in files:
+            index.setdefault(checksums[part], []).append((variant, part))
+    return index
+
+SHA1_INDEX = build_sha1_index(VARIANTS)
+
+class InstallError(Exception):
+    pass
+
+# Machine-readable timing and throughput of an install: wall time and bytes read and
+# written per phase and per file plus the hash throughput (--report json|summary)
+class InstallReport:
+    def __init__(self):
+        self.phases = []
+        self.files = []
+        self.variant = None
+        self.start = time.monotonic()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        entry = {"phase": name, "seconds": 0.0, "bytes_read": 0, "bytes_written": 0}
+        start = time.monotonic()
+        try:
+            yield entry
+        finally:
+            entry["seconds"] = time.monotonic() - start
+            self.phases.append(entry)
+
+    def file(self, phase, name, seconds, bytes_read=0, bytes_written=0, hashed=False):
+        # Called from the worker threads, list.append is atomic
+        self.files.append({"phase": phase, "file": name, "seconds": seconds,
+                           "bytes_read": bytes_read, "bytes_written": bytes_written, "hashed": hashed})
+
+    def as_dict(self):
+        hashed = [f for f in self.files if f["hashed"]]
+        hashed_bytes = sum(f["bytes_read"] for f in hashed)
+        hashed_seconds = sum(f["seconds"] for f in hashed)
+        return {
+            "variant": self.variant,
+            "seconds": time.monotonic() - self.start,
+            "bytes_read": sum(p["bytes_read"] for p in self.phases),
+            "bytes_written": sum(p["bytes_written"] for p in self.phases),
+            "hashed_bytes": hashed_bytes,
+            "hash_mb_per_s": hashed_bytes / hashed_seconds / 1e6 if hashed_seconds else None,
+            "phases": self.phases,
+            "files": self.files,
+        }
+
+    def summary(self):
+        report = self.as_dict()
+        phases = " ".join(f"{p['phase']}={p['seconds'] * 1000:.1f}ms" for p in report["phases"])
+        hash_rate = f"{report['hash_mb_per_s']:.1f}MB/s" if report["hash_mb_per_s"] else "-"
+        return (f"variant={report['variant']} total={report['seconds'] * 1000:.1f}ms {phases} "
+                f"read={report['bytes_read']}B written={report['bytes_written']}B hash={hash_rate}")
+
+# Zip entries are decompressed in chunks of this size into a single reused buffer
+READ_CHUNK = 64 * 1024
+
+def calculate_sha1(zip_ref, name, buf=None):
+    # Decompress the entry exactly once: the SHA-1 is computed in the same pass
+    # that collects the bytes which are later written to the output folder.
+    with zip_ref.open(name) as f:
+        return hash_stream(f, buf)
+
+def hash_stream(f, buf=None):
+    if buf is None:
+        buf = bytearray(READ_CHUNK)
+    view = memoryview(buf)
     sha1_hash = hashlib.sha1()
-    with open(file_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha1_hash.update(byte_block)
-    return sha1_hash.hexdigest()
-
-def verify_checksums(temp_path,EXPECTED_CHKSM,EXPECTED_FILES):
-    for file in EXPECTED_FILES:
-        file_path = os.path.join(temp_path, file)
-        calculated_checksum = calculate_sha1(file_path)
-        expected_checksum = EXPECTED_CHKSM[file]
-        if calculated_checksum != expected_checksum:
-            print(f"Error: Checksum mismatch for {file}")
-            print(f"Expected: {expected_checksum}")
-            print(f"Calculated: {calculated_checksum}")
-            sys.exit(1)
-            
-               
-def split_and_copy_binary_file(input_file, output_file1, output_file2, output_folder,temp_dir):
+    data = bytearray()
+    while True:
+        n = f.readinto(buf)
+        if not n:
+            break
+        sha1_hash.update(view[:n])
+        data += view[:n]
+    return sha1_hash.hexdigest(), bytes(data)
+
+# Sizes of the individual ROM chips as expected by the core (see CORE/vhdl/globals.vhd)
+ROM_SIZES = {
+    "xvi_1.3p": 4096, "xvi_2.3m": 4096, "xvi_3.2m": 4096, "xvi_4.2l": 4096,
+    "xvi_u_.3p": 4096, "xv_2-2.3m": 4096, "xv_2-3.2m": 4096, "xvi_u_.2l": 4096,
+    "xv3_1.3p": 4096, "xv3_2.3m": 4096, "xv3_3.2m": 4096, "xv3_4.2l": 4096,
+    "xea-1m-a.bin": 8192, "xea-1l-a.bin": 8192,
+    "xvi_5.3f": 4096, "xvi_6.3j": 4096, "xv2_5.3f": 4096, "xv3_5.3f": 4096, "xv3_6.3j": 4096,
+    "xea-4c-a.bin": 8192,
+    "xvi_7.2c": 4096,
+    "xvi_12.3b": 4096,
+    "xvi_13.3c": 4096, "xvi_14.3d": 4096,
+    "xvi_15.4m": 8192, "xvi_17.4p": 8192, "xvi_16.4n": 4096, "xvi_18.4r": 8192,
+    "xvi_9.2a": 4096, "xvi_10.2b": 8192, "xvi_11.2c": 4096,
+    "50xx.bin": 2048, "51xx.bin": 1024, "54xx.bin": 1024,
+}
+
+# The core expects its files in DIR_START and its config file, which holds the saved
+# settings, as OPTM_SIZE bytes named like CFG_FILE (see CORE/vhdl/config.vhd). Within
+# a checkout of the repository they are read from config.vhd by M2M/tools/core_config.py.
+# The installer can also be downloaded on its own, then the values of this release are used.
+DIR_START = "/arcade/xevious"
+CFG_NAME = "xevcfg"
+CFG_SIZE = 99
+
+def core_config_spec():
+    # Returns (core folder on the SD card, name of the config file, size of the config file)
+    tools = os.path.join(os.path.dirname(os.path.abspath(__file__)), "M2M", "tools")
+    if not os.path.isfile(os.path.join(tools, "core_config.py")):
+        return DIR_START, CFG_NAME, CFG_SIZE
+    sys.path.insert(0, tools)
     try:
-    
-        fname1=output_file1
-        fname2=output_file2
-        fname1 = output_file1
-        fname2 = output_file2
-        output_file1 = os.path.join(temp_dir, fname1)
-        output_file2 = os.path.join(temp_dir, fname2)
-        
-        # Split the binary file into two halves
-        with open(input_file, 'rb') as f:
-            file_contents = f.read()
-            midpoint = len(file_contents) // 2
-            first_half = file_contents[:midpoint]
-            second_half = file_contents[midpoint:]
-
-             # Determine the output file paths
-            output_path1 = os.path.join(temp_dir, output_file1)
-            output_path2 = os.path.join(temp_dir, output_file2)
-       
-            # Write the halves to temporary files
-            with open(output_path1, 'wb') as out1:
-                out1.write(first_half)
-            with open(output_path2, 'wb') as out2:
-                out2.write(second_half)
-       
-            # Copy the split files to the output folder
-            print(f"Copying {fname1} to output folder")
-            shutil.copy(output_path1, os.path.join(output_folder, fname1))
-            print(f"Copying {fname2} to output folder")
-            shutil.copy(output_path2, os.path.join(output_folder, fname2))
+        import core_config
+        dir_start, cfg_file, optm_size = core_config.get_constants(["DIR_START", "CFG_FILE", "OPTM_SIZE"])
+    except (ImportError, OSError, KeyError) as e:
+        raise InstallError(f"Could not read DIR_START, CFG_FILE and OPTM_SIZE from config.vhd: {e}")
+    finally:
+        sys.path.remove(tools)
+    return dir_start, os.path.basename(cfg_file), optm_size
+
+# Verified parts are remembered in a small on-disk cache, keyed on the zip path plus
+# the entry's name, CRC32, size and the zip's mtime, so that re-installing an already
+# verified set does not need to hash anything. Least recently used entries are evicted.
+VERIFY_CACHE_FILE = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+                                 "xevious_rom_installer", "verified.json")
+VERIFY_CACHE_MAX_ENTRIES = 2048
+
+def cache_key(zip_ref, info):
+    zip_path = os.path.abspath(zip_ref.filename)
+    return f"{zip_path}|{info.filename}|{info.CRC:08x}|{info.file_size}|{os.stat(zip_path).st_mtime_ns}"
+
+def load_verify_cache(cache_file):
+    try:
+        with open(cache_file, "r") as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_verify_cache(cache_file, cache, forget=None):
+    # Several installs might share the cache: the entries that other processes saved
+    # in the meantime are kept, except those starting with forget, a prefix or a
+    # tuple of prefixes (see --reverify).
+    # The dict keeps insertion order: the oldest entries are the least recently used
+    merged = {key: value for key, value in load_verify_cache(cache_file).items()
+              if key not in cache and not (forget is not None and key.startswith(forget))}
+    merged.update(cache)
+    while len(merged) > VERIFY_CACHE_MAX_ENTRIES:
+        del merged[next(iter(merged))]
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(merged, f)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print(f"Warning: Could not write verification cache {cache_file}: {e}")
+
+# A part that is not held in memory but copied from a file region
+FileRange = namedtuple("FileRange", ["path", "offset", "length"])
+
+def zip_data_offset(zip_ref, info):
+    # The data of an entry starts behind its local header, whose extra field may
+    # differ from the one in the central directory
+    with open(zip_ref.filename, "rb") as f:
+        f.seek(info.header_offset)
+        header = f.read(30)
+    if header[0:4] != b"PK\x03\x04":
+        raise zipfile.BadZipFile(f"Bad local file header for {info.filename}")
+    return info.header_offset + 30 + int.from_bytes(header[26:28], "little") + int.from_bytes(header[28:30], "little")
+
+# Upper bound for the amount of parts that are hashed concurrently
+VERIFY_WORKERS = 8
+
+def verify_entry(zip_ref, file, expected_checksum, cache=None, report=None):
+    # Returns (file, error, data): error is None or a tuple (kind, expected, calculated)
+    # Fast reject: the uncompressed size is stored in the zip central directory,
+    # so a wrong dump is caught before anything is decompressed.
+    start = time.monotonic()
+    info = zip_ref.getinfo(file)
+    expected_size = ROM_SIZES.get(file)
+    if expected_size is not None and info.file_size != expected_size:
+        return file, ("Size", f"{expected_size} bytes", f"{info.file_size} bytes (CRC32 {info.CRC:08x})"), None
+    try:
+        if cache is not None and cache.get(cache_key(zip_ref, info)) == expected_checksum:
+            # Already verified: stored entries are later copied kernel-side straight out
+            # of the zip, others are decompressed while zipfile checks the CRC32
+            if info.compress_type == zipfile.ZIP_STORED:
+                data = FileRange(os.path.abspath(zip_ref.filename), zip_data_offset(zip_ref, info), info.file_size)
+                if report is not None:
+                    report.file("verify", file, time.monotonic() - start)
+                return file, None, data
+            data = zip_ref.read(info)
+            if report is not None:
+                report.file("verify", file, time.monotonic() - start, len(data))
+            return file, None, data
+        calculated_checksum, data = calculate_sha1(zip_ref, file)
+        if report is not None:
+            report.file("verify", file, time.monotonic() - start, len(data), hashed=True)
+    except zipfile.BadZipFile as e:
+        # zipfile checks the decompressed data against the CRC32 of the central directory
+        return file, ("Checksum", expected_checksum, str(e)), None
+    if calculated_checksum != expected_checksum:
+        return file, ("Checksum", expected_checksum, calculated_checksum), data
+    return file, None, data
+
+def verify_checksums(zip_ref,EXPECTED_CHKSM,EXPECTED_FILES,cache=None,report=None):
+    # Hash all parts concurrently (zlib and hashlib release the GIL) and report
+    # every mismatching part instead of stopping at the first one.
+    roms = {}
+    failed = []
+    block_table = None
+    workers = max(1, min(VERIFY_WORKERS, len(EXPECTED_FILES)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda f: verify_entry(zip_ref, f, EXPECTED_CHKSM[f], cache, report), EXPECTED_FILES)
+        for file, error, data in results:
+            if error is None:
+                roms[file] = data
+                if cache is not None:
+                    key = cache_key(zip_ref, zip_ref.getinfo(file))
+                    cache.pop(key, None)
+                    cache[key] = EXPECTED_CHKSM[file]
+                continue
+            failed.append(file)
+            print(f"Error: {error[0]} mismatch for {file}")
+            print(f"Expected: {error[1]}")
+            print(f"Calculated: {error[2]}")
+            # Localize the differences if the good part is described in the block hash table
+            if block_table is None:
+                block_table = load_block_table(BLOCK_TABLE_FILE) or {"parts": {}}
+            entry = block_table["parts"].get(EXPECTED_CHKSM[file])
+            if entry is not None:
+                try:
+                    bad_data = data if data is not None else zip_ref.read(file)
+                except zipfile.BadZipFile:
+                    bad_data = None
+                if bad_data is not None:
+                    for finding in diagnose_part(bad_data, entry):
+                        print(f"  {finding}")
+    if failed:
+        raise InstallError(f"{len(failed)} of {len(EXPECTED_FILES)} ROM parts failed verification: {', '.join(failed)}")
+    return roms
+
+# Block hash tables: for known-good parts, a table with the hash of every
+# BLOCK_LEAF_SIZE byte block (plus the OR and AND of its bytes) localizes the
+# differences of a bad dump in a single pass, without the good ROM at hand. The
+# table is generated once from a known-good set with --make-block-table and only
+# loaded when a part fails verification.
+BLOCK_LEAF_SIZE = 256
+BLOCK_DIGEST_SIZE = 8
+BLOCK_TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "xevious_rom_blocks.json")
+
+def block_leaves(data):
+    # Returns (digests, or masks, and masks) of all blocks of data
+    digests, or_masks, and_masks = [], bytearray(), bytearray()
+    view = memoryview(data)
+    for pos in range(0, len(data), BLOCK_LEAF_SIZE):
+        block = view[pos:pos + BLOCK_LEAF_SIZE]
+        digests.append(hashlib.sha1(block).digest()[:BLOCK_DIGEST_SIZE])
+        or_mask, and_mask = 0, 0xFF
+        for value in set(block.tobytes()):
+            or_mask |= value
+            and_mask &= value
+        or_masks.append(or_mask)
+        and_masks.append(and_mask)
+    return digests, or_masks, and_masks
+
+def make_block_table(source, table_file=BLOCK_TABLE_FILE):
+    # Adds every known-good part found in a zip or folder to the block hash table
+    table = load_block_table(table_file) or {"leaf_size": BLOCK_LEAF_SIZE, "parts": {}}
+    if os.path.isdir(source):
+        hashed = hash_dir_entries(source)
+    else:
+        try:
+            with zipfile.ZipFile(source, "r") as zip_ref:
+                hashed = hash_zip_entries(zip_ref)
+        except FileNotFoundError:
+            raise InstallError(f"ZIP file not found: {source}")
+        except zipfile.BadZipFile:
+            raise InstallError(f"Invalid or corrupted ZIP file: {source}")
+    added = 0
+    for name, checksum, data in hashed:
+        if checksum not in SHA1_INDEX or checksum in table["parts"]:
+            continue
+        data = b"".join(segment_data([(name, 0, data.length if isinstance(data, FileRange) else len(data))], {name: data}))
+        digests, or_masks, and_masks = block_leaves(data)
+        table["parts"][checksum] = {"part": SHA1_INDEX[checksum][0][1], "size": len(data),
+                                    "leaves": b"".join(digests).hex(), "or": or_masks.hex(), "and": and_masks.hex()}
+        added += 1
+    tmp_file = table_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(table, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, table_file)
+    print(f"Added {added} parts to {table_file}, it now describes {len(table['parts'])} parts.")
+
+def load_block_table(table_file=BLOCK_TABLE_FILE):
+    try:
+        with open(table_file, "r") as f:
+            table = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(table, dict) or table.get("leaf_size") != BLOCK_LEAF_SIZE or not isinstance(table.get("parts"), dict):
+        return None
+    return table
+
+def format_ranges(blocks, size):
+    # Coalesces block numbers into address ranges
+    ranges = []
+    for block in blocks:
+        if ranges and ranges[-1][1] == block - 1:
+            ranges[-1][1] = block
+        else:
+            ranges.append([block, block])
+    return ", ".join(f"0x{first * BLOCK_LEAF_SIZE:04X}-0x{min((last + 1) * BLOCK_LEAF_SIZE, size) - 1:04X}" for first, last in ranges)
+
+def diagnose_part(data, entry):
+    # Compares a bad dump against the block hash table entry of the good part and
+    # returns a list of findings
+    size = entry["size"]
+    good = [bytes.fromhex(entry["leaves"][i:i + 2 * BLOCK_DIGEST_SIZE]) for i in range(0, len(entry["leaves"]), 2 * BLOCK_DIGEST_SIZE)]
+    good_or, good_and = bytes.fromhex(entry["or"]), bytes.fromhex(entry["and"])
+    bad, bad_or, bad_and = block_leaves(data[:size])
+    findings = []
+
+    if len(data) < size:
+        findings.append(f"Truncated: {len(data)} of {size} bytes, 0x{len(data):04X}-0x{size - 1:04X} is missing")
+    elif len(data) > size:
+        findings.append(f"Overdump: {len(data) - size} bytes more than the {size} bytes of the part")
+    differing = [i for i in range(len(good)) if i >= len(bad) or bad[i] != good[i]]
+    if not differing:
+        if len(data) > size:
+            findings.append(f"The first {size} bytes are good")
+        return findings
+    findings.append(f"{len(differing)} of {len(good)} blocks differ: {format_ranges(differing, size)}")
+
+    # An inverted or stuck address line shows up as blocks that are good, but at the wrong address
+    for bit in range(max(len(good) - 1, 0).bit_length()):
+        if len(bad) == len(good) and all(bad[i] == good[i ^ (1 << bit)] for i in range(len(good))):
+            findings.append(f"Likely cause: address line A{bit + BLOCK_LEAF_SIZE.bit_length() - 1} is inverted"
+                            + (" (the halves are swapped)" if 1 << (bit + 1) == len(good) else ""))
+            return findings
+        for value in (0, 1):
+            source = [i & ~(1 << bit) | (value << bit) for i in range(len(bad))]
+            if all(bad[i] == good[source[i]] for i in range(len(bad))) and source != list(range(len(bad))):
+                findings.append(f"Likely cause: address line A{bit + BLOCK_LEAF_SIZE.bit_length() - 1} is stuck at {value}")
+                return findings
+
+    # A stuck data line: a bit that never changes within the whole dump, but does in
+    # the good part (if no bit changes at all, the dump is blank, see below)
+    all_bad_or, all_bad_and = 0, 0xFF
+    for i in range(len(bad)):
+        all_bad_or |= bad_or[i]
+        all_bad_and &= bad_and[i]
+    stuck = [f"D{bit} stuck at 0" for bit in range(8) if not all_bad_or & (1 << bit) and any(v & (1 << bit) for v in good_or)]
+    stuck += [f"D{bit} stuck at 1" for bit in range(8) if all_bad_and & (1 << bit) and any(not v & (1 << bit) for v in good_and)]
+    if stuck and len(stuck) < 8:
+        findings.append(f"Likely cause: data line {', '.join(stuck)}")
+
+    blank = [i for i in differing if i < len(bad) and bad_or[i] == bad_and[i] and bad_or[i] in (0x00, 0xFF)]
+    if blank:
+        findings.append(f"Blank (all 0x00 or 0xFF): {format_ranges(blank, size)}")
+    return findings
+
+# Romset database: MAME -listxml / Logiqx XML and ClrMamePro DAT files are imported
+# with --import-dat into an SQLite database indexed by SHA-1 and by CRC32 and size.
+# The database is only opened when it is needed: --audit matches the entries of any
+# zip or folder against all imported sets, computing CRC32, SHA-1 and MD5 in a single
+# read pass. Imported sets that consist of the same ROM names and sizes as one of the
+# supported variants can also be installed, using the layout of that variant.
+ROMSET_DB_FILE = os.path.join(os.path.dirname(VERIFY_CACHE_FILE), "romsets.sqlite")
+ROMSET_DB_VERSION = 2
+DAT_TOKEN = re.compile(r'"([^"]*)"|([()])|([^\s()"]+)')
+
+def multi_digest(f, buf=None):
+    # Returns (crc32, sha1, md5, size) of a stream, all computed in one pass
+    if buf is None:
+        buf = bytearray(READ_CHUNK)
+    view = memoryview(buf)
+    crc = 0
+    sha1_hash, md5_hash = hashlib.sha1(), hashlib.md5()
+    size = 0
+    while True:
+        n = f.readinto(buf)
+        if not n:
+            break
+        crc = zlib.crc32(view[:n], crc)
+        sha1_hash.update(view[:n])
+        md5_hash.update(view[:n])
+        size += n
+    return f"{crc:08x}", sha1_hash.hexdigest(), md5_hash.hexdigest(), size
+
+def parse_clrmamepro(text):
+    # Yields (set name, description, cloneof, [(rom name, size, crc, sha1, md5)])
+    tokens = ((match[1] if match[1] is not None else match[2] or match[3], match[2])
+              for match in DAT_TOKEN.finditer(text))
+    def block():
+        # Returns the key/value pairs of a block as a list, nested blocks as lists
+        items = []
+        for token, paren in tokens:
+            if paren == ")":
+                return items
+            if paren == "(":
+                items.append(block())
+            else:
+                items.append(token)
+        return items
+    for token, paren in tokens:
+        if paren or token not in ("game", "machine", "resource"):
+            continue
+        next(tokens, None)
+        items = block()
+        fields = dict(zip(items[0::2], items[1::2]))
+        roms = []
+        for key, value in zip(items[0::2], items[1::2]):
+            if key == "rom" and isinstance(value, list):
+                rom = dict(zip(value[0::2], value[1::2]))
+                if "nodump" in (rom.get("flags"), rom.get("status")):
+                    continue
+                roms.append((rom.get("name"), int(rom.get("size", 0)), rom.get("crc"), rom.get("sha1"), rom.get("md5")))
+        yield fields.get("name"), fields.get("description"), fields.get("cloneof"), roms
+
+def parse_xml_dat(dat_file):
+    # Streams the sets of a MAME -listxml or Logiqx XML file
+    import xml.etree.ElementTree as ElementTree
+    for event, element in ElementTree.iterparse(dat_file):
+        if element.tag not in ("game", "machine"):
+            continue
+        roms = [(rom.get("name"), int(rom.get("size", 0)), rom.get("crc"), rom.get("sha1"), rom.get("md5"))
+                for rom in element.iter("rom") if rom.get("status") != "nodump"]
+        yield element.get("name"), element.findtext("description"), element.get("cloneof"), roms
+        element.clear()
+
+def open_romset_db(db_file=ROMSET_DB_FILE, create=False):
+    # Returns an sqlite3 connection or None if there is no database
+    if not create and not os.path.isfile(db_file):
+        return None
+    import sqlite3
+    os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+    db = sqlite3.connect(db_file)
+    # The schema is only touched when the database is new or older, so that
+    # concurrent installs just read it
+    try:
+        if db.execute("PRAGMA user_version").fetchone()[0] != ROMSET_DB_VERSION:
+            db.executescript(f"""
+                CREATE TABLE IF NOT EXISTS sets (name TEXT PRIMARY KEY, description TEXT, cloneof TEXT, dat TEXT);
+                CREATE TABLE IF NOT EXISTS roms (set_name TEXT, name TEXT, size INTEGER, crc TEXT, sha1 TEXT, md5 TEXT);
+                CREATE INDEX IF NOT EXISTS roms_sha1 ON roms (sha1);
+                CREATE INDEX IF NOT EXISTS roms_crc ON roms (crc, size);
+                CREATE INDEX IF NOT EXISTS roms_set ON roms (set_name);
+                CREATE INDEX IF NOT EXISTS roms_name ON roms (name);
+                PRAGMA user_version = {ROMSET_DB_VERSION};
+            """)
+    except sqlite3.Error as e:
+        db.close()
+        raise InstallError(f"Could not open the romset database {db_file}: {e}")
+    return db
+
+def import_dat(dat_file, db_file=ROMSET_DB_FILE):
+    import sqlite3
+    import xml.etree.ElementTree as ElementTree
+    try:
+        with open(dat_file, "r", encoding="utf-8", errors="replace") as f:
+            head = f.read(1024).lstrip()
+            f.seek(0)
+            sets = parse_xml_dat(dat_file) if head.startswith("<") else parse_clrmamepro(f.read())
+            with contextlib.closing(open_romset_db(db_file, create=True)) as db:
+                count = roms = 0
+                with db:
+                    for name, description, cloneof, set_roms in sets:
+                        if not name:
+                            continue
+                        db.execute("DELETE FROM roms WHERE set_name = ?", (name,))
+                        db.execute("INSERT OR REPLACE INTO sets VALUES (?, ?, ?, ?)", (name, description, cloneof, os.path.basename(dat_file)))
+                        db.executemany("INSERT INTO roms VALUES (?, ?, ?, ?, ?, ?)",
+                                       [(name, rom, size, crc and crc.lower(), sha1 and sha1.lower(), md5 and md5.lower())
+                                        for rom, size, crc, sha1, md5 in set_roms])
+                        count += 1
+                        roms += len(set_roms)
+                total = db.execute("SELECT COUNT(*) FROM sets").fetchone()[0]
+    except FileNotFoundError:
+        raise InstallError(f"DAT file not found: {dat_file}")
+    except ElementTree.ParseError as e:
+        raise InstallError(f"Invalid XML in {dat_file}: {e}")
+    except ValueError as e:
+        raise InstallError(f"Invalid value in {dat_file}: {e}")
+    except (sqlite3.Error, OSError) as e:
+        raise InstallError(f"Could not import {dat_file} into {db_file}: {e}")
+    print(f"Imported {count} sets with {roms} ROMs from {dat_file}, the database now holds {total} sets.")
+
+DAT_VARIANTS_REGISTERED = False
+
+def register_dat_variants(db_file=ROMSET_DB_FILE):
+    # Adds the imported sets that match the file list of a supported variant to
+    # VARIANTS and SHA1_INDEX; runs only once and only if there is a database
+    global DAT_VARIANTS_REGISTERED
+    if DAT_VARIANTS_REGISTERED:
+        return
+    DAT_VARIANTS_REGISTERED = True
+    import sqlite3
+    db = open_romset_db(db_file)
+    if db is None:
+        return
+    # The sets of real DATs also list parts the core does not use, such as the color
+    # PROMs, so a set matches when it contains all files of a variant with their sizes.
+    # The variant with the most files wins.
+    layouts = sorted({tuple(files): layout for files, checksums, layout in VARIANTS.values()}.items(),
+                     key=lambda item: -len(item[0]))
+    # Only the rows of the parts the core knows are read, using the index on the name
+    sets = {}
+    query = f"SELECT set_name, name, size, sha1 FROM roms WHERE name IN ({', '.join('?' * len(ROM_SIZES))}) AND sha1 IS NOT NULL"
+    try:
+        with contextlib.closing(db):
+            for set_name, name, size, sha1 in db.execute(query, list(ROM_SIZES)):
+                sets.setdefault(set_name, {})[name] = (size, sha1)
+    except sqlite3.Error as e:
+        raise InstallError(f"Could not read the romset database {db_file}: {e}")
+    for set_name, roms in sets.items():
+        if set_name in VARIANTS:
+            continue
+        for files, layout in layouts:
+            if all(part in roms and roms[part][0] == ROM_SIZES[part] for part in files):
+                break
+        else:
+            continue
+        VARIANTS[set_name] = (files, {part: roms[part][1] for part in files}, layout)
+        for part in files:
+            SHA1_INDEX.setdefault(roms[part][1], []).append((set_name, part))
+
+def audit(source, db_file=ROMSET_DB_FILE):
+    # Matches every entry of a zip or folder against the romset database
+    import sqlite3
+    if not os.path.isfile(db_file):
+        raise InstallError(f"No romset database found at {db_file}, import a DAT file with --import-dat first")
+    register_dat_variants(db_file)
+    entries = []
+    if os.path.isdir(source):
+        for root, dirs, names in os.walk(source):
+            dirs.sort()
+            for name in sorted(names):
+                with open(os.path.join(root, name), "rb") as f:
+                    entries.append((os.path.relpath(os.path.join(root, name), source), *multi_digest(f)))
+    else:
+        try:
+            with zipfile.ZipFile(source, "r") as zip_ref:
+                for info in zip_ref.infolist():
+                    if not info.is_dir():
+                        with zip_ref.open(info) as f:
+                            entries.append((info.filename, *multi_digest(f)))
+        except FileNotFoundError:
+            raise InstallError(f"ZIP file not found: {source}")
+        except zipfile.BadZipFile as e:
+            raise InstallError(f"Invalid or corrupted ZIP file: {source}: {e}")
+
+    try:
+        with contextlib.closing(open_romset_db(db_file)) as db:
+            found = {}
+            for name, crc, sha1, md5, size in entries:
+                matches = db.execute("SELECT set_name, name, md5 FROM roms WHERE sha1 = ?", (sha1,)).fetchall()
+                how = "SHA-1"
+                if not matches:
+                    matches = db.execute("SELECT set_name, name, md5 FROM roms WHERE sha1 IS NULL AND crc = ? AND size = ?",
+                                         (crc, size)).fetchall()
+                    how = "CRC32"
+                if not matches:
+                    print(f"{name}: unknown (CRC32 {crc}, {size} bytes)")
+                    continue
+                bad_md5 = [f"{s}/{r}" for s, r, m in matches if m and m != md5]
+                print(f"{name}: {how} match for " + ", ".join(f"{s}/{r}" for s, r, m in matches[:4])
+                      + (f" and {len(matches) - 4} more" if len(matches) > 4 else "")
+                      + (f", MD5 MISMATCH for {', '.join(bad_md5)}" if bad_md5 else ""))
+                for set_name, rom, m in matches:
+                    found.setdefault(set_name, set()).add(rom)
+
+            print()
+            complete = 0
+            for set_name in sorted(found):
+                total = db.execute("SELECT COUNT(DISTINCT name) FROM roms WHERE set_name = ?", (set_name,)).fetchone()[0]
+                description = db.execute("SELECT description FROM sets WHERE name = ?", (set_name,)).fetchone()[0]
+                state = "complete" if len(found[set_name]) >= total else f"{len(found[set_name])} of {total} ROMs"
+                complete += len(found[set_name]) >= total
+                print(f"{set_name:<12} {state:<16} {description or ''}" + ("  (installable)" if set_name in VARIANTS else ""))
+    except sqlite3.Error as e:
+        raise InstallError(f"Could not read the romset database {db_file}: {e}")
+    print(f"\n{len(entries)} entries checked, {complete} complete sets found.")
+
+# Identification by content: every candidate entry of a zip or a loose directory is
+# hashed once and looked up in SHA1_INDEX. This works for renamed archives, merged
+# MAME sets that contain several variants and entries with wrong file names.
+# Only entries whose size is one of the known ROM sizes are candidates.
+
+def hash_zip_entries(zip_ref, cache=None, report=None, seen=None):
+    # seen is an optional set of (CRC32, size) of entries that were already hashed in
+    # other zips; these are skipped and the entries of this zip are added
+    known_sizes = set(ROM_SIZES.values())
+    infos = [i for i in zip_ref.infolist() if not i.is_dir() and i.file_size in known_sizes]
+    if seen is not None:
+        infos = [i for i in infos if (i.CRC, i.file_size) not in seen]
+        seen.update((i.CRC, i.file_size) for i in infos)
+
+    def hash_entry(info):
+        start = time.monotonic()
+        checksum = cache.get(cache_key(zip_ref, info)) if cache is not None else None
+        hashed = checksum not in SHA1_INDEX
+        if not hashed and info.compress_type == zipfile.ZIP_STORED:
+            data = FileRange(os.path.abspath(zip_ref.filename), zip_data_offset(zip_ref, info), info.file_size)
+        elif not hashed:
+            data = zip_ref.read(info)
+        else:
+            checksum, data = calculate_sha1(zip_ref, info)
+        if report is not None:
+            report.file("identify", info.filename, time.monotonic() - start,
+                        0 if isinstance(data, FileRange) else len(data), hashed=hashed)
+        return info.filename, checksum, data
+
+    with ThreadPoolExecutor(max_workers=VERIFY_WORKERS) as pool:
+        hashed = list(pool.map(hash_entry, infos))
+    if cache is not None:
+        for name, checksum, data in hashed:
+            if checksum in SHA1_INDEX:
+                key = cache_key(zip_ref, zip_ref.getinfo(name))
+                cache.pop(key, None)
+                cache[key] = checksum
+    return hashed
+
+def hash_dir_entries(path, report=None):
+    known_sizes = set(ROM_SIZES.values())
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        for name in sorted(names):
+            file_path = os.path.join(root, name)
+            if os.path.isfile(file_path) and os.path.getsize(file_path) in known_sizes:
+                files.append(file_path)
+
+    def hash_file(file_path):
+        start = time.monotonic()
+        with open(file_path, "rb") as f:
+            checksum, data = hash_stream(f)
+        if report is not None:
+            report.file("identify", file_path, time.monotonic() - start, len(data), hashed=True)
+        return os.path.relpath(file_path, path), checksum, data
+
+    with ThreadPoolExecutor(max_workers=VERIFY_WORKERS) as pool:
+        return list(pool.map(hash_file, files))
+
+def match_variants(hashed):
+    # Returns ({variant: {part: data}}, {(variant, part): entry name}, complete variants)
+    found = {variant: {} for variant in VARIANTS}
+    entry_names = {}
+    for name, checksum, data in hashed:
+        for variant, part in SHA1_INDEX.get(checksum, []):
+            if part not in found[variant]:
+                found[variant][part] = data
+                entry_names[(variant, part)] = name
+    complete = [v for v in VARIANTS if len(found[v]) == len(VARIANTS[v][0])]
+    return found, entry_names, complete
+
+def identify_romset(hashed, preferred=None):
+    # Returns (variant, roms) for the first complete variant: the preferred one (if it
+    # is complete), otherwise in the order of VARIANTS
+    found, entry_names, complete = match_variants(hashed)
+    if not complete:
+        closest = max(VARIANTS, key=lambda v: len(found[v]))
+        missing = [part for part in VARIANTS[closest][0] if part not in found[closest]]
+        raise InstallError(f"No complete romset found, closest match is {closest}, "
+                           f"missing or bad: {', '.join(missing)}")
+
+    variant = preferred if preferred in complete else complete[0]
+    print(f"Identified romset: {variant}")
+    if len(complete) > 1:
+        print(f"Also found complete romsets: {', '.join(v for v in complete if v != variant)} (use --variant to choose)")
+    for part in VARIANTS[variant][0]:
+        name = entry_names[(variant, part)]
+        if os.path.basename(name) != part:
+            print(f"Using {name} as {part}")
+    return variant, found[variant]
+
+# The planner compiles a layout once into a minimal list of I/O operations: one
+# operation per output file, made of source segments where adjacent ranges of the
+# same part are coalesced. Segments held in memory are written with one large
+# write, file regions are copied kernel-side.
+
+def compile_plan(layout, roms):
+    plan = []
+    for section, outputs in layout:
+        for output_file, ranges in outputs:
+            segments = []
+            for part, start, end in ranges:
+                source = roms[part]
+                length = source.length if isinstance(source, FileRange) else len(source)
+                end = length if end is None else end
+                if segments and segments[-1][0] == part and segments[-1][2] == start:
+                    segments[-1][2] = end
+                else:
+                    segments.append([part, start, end])
+            if len(ranges) == 1 and (output_file == ranges[0][0] or ranges[0][2] is not None):
+                message = f"Copying {output_file} to output folder"
+            else:
+                message = "\n".join(f"Appending {part} to {output_file}" for part, _, _ in ranges)
+            plan.append((section, output_file, message, segments))
+    return plan
+
+def copy_file_range(src_fd, dst_fd, offset, length):
+    # Kernel-side copy: copy_file_range, then sendfile, then a plain read/write loop,
+    # which is all there is on Windows
+    copied = 0
+    for method in ("copy_file_range", "sendfile"):
+        if not hasattr(os, method):
+            continue
+        try:
+            while copied < length:
+                if method == "copy_file_range":
+                    n = os.copy_file_range(src_fd, dst_fd, length - copied, offset + copied)
+                else:
+                    n = os.sendfile(dst_fd, src_fd, offset + copied, length - copied)
+                if n == 0:
+                    break
+                copied += n
+            if copied == length:
+                return
+        except OSError:
+            pass
+    os.lseek(src_fd, offset + copied, os.SEEK_SET)
+    while copied < length:
+        data = os.read(src_fd, min(READ_CHUNK, length - copied))
+        if not data:
+            raise InstallError("Unexpected end of file while copying ROM data")
+        write_all(dst_fd, data)
+        copied += len(data)
+
+def write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+# Incremental install: the expected SHA-1 of every output file is known before anything
+# is written, so only files whose content differs are rewritten. INSTALL_MANIFEST in the
+# output folder remembers digest, size and mtime of the written files, which lets later
+# runs skip even reading the existing files.
+INSTALL_MANIFEST = ".xevious_install.json"
+
+def segment_data(segments, roms):
+    for part, start, end in segments:
+        source = roms[part]
+        if isinstance(source, FileRange):
+            with open(source.path, "rb") as src:
+                src.seek(source.offset + start)
+                yield src.read(end - start)
+        else:
+            yield memoryview(source)[start:end]
+
+def output_digest(segments, roms):
+    sha1_hash = hashlib.sha1()
+    size = 0
+    for data in segment_data(segments, roms):
+        sha1_hash.update(data)
+        size += len(data)
+    return sha1_hash.hexdigest(), size
+
+def load_install_manifest(output_folder):
+    try:
+        with open(os.path.join(output_folder, INSTALL_MANIFEST), "r") as f:
+            manifest = json.load(f)
+        return manifest if isinstance(manifest, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_install_manifest(output_folder, manifest):
+    manifest_file = os.path.join(output_folder, INSTALL_MANIFEST)
+    with open(manifest_file + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+def is_up_to_date(path, digest, size, entry):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return False
+    if st.st_size != size:
+        return False
+    if entry is not None and entry.get("sha1") == digest and entry.get("size") == size and entry.get("mtime_ns") == st.st_mtime_ns:
+        return True
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest() == digest
+
+def execute_plan(plan, roms, writer, force=False, shared=None):
+    # Stages every output file whose content differs from the one in the output folder
+    # and returns the manifest entries (without mtime) of all output files. shared maps
+    # (sha1, size) to an output file of an earlier plan with that content; instead of
+    # being staged again, such files are added to writer.links as (source, destination).
+    manifest = load_install_manifest(writer.output_folder)
+    expected = {}
+    section = None
+    for op_section, output_file, message, segments in plan:
+        if op_section != section:
+            section = op_section
+            print(f"\n{section}")
+            print("-" * len(section))
+        path = os.path.join(writer.output_folder, output_file)
+        digest, size = output_digest(segments, roms)
+        if not force and is_up_to_date(path, digest, size, manifest.get(output_file)):
+            print(f"{output_file} is up to date")
+            if shared is not None:
+                shared.setdefault((digest, size), path)
+        elif shared is not None and (digest, size) in shared:
+            print(f"Linking {output_file} to {shared[(digest, size)]}")
+            writer.links.append((shared[(digest, size)], output_file))
+        else:
+            print(message)
+            writer.stage(output_file, segments, roms)
+            if shared is not None:
+                shared[(digest, size)] = path
+        expected[output_file] = {"sha1": digest, "size": size}
+    return expected
+
+def update_install_manifest(output_folder, expected):
+    manifest = load_install_manifest(output_folder)
+    new_manifest = {}
+    for output_file, entry in expected.items():
+        new_manifest[output_file] = dict(entry, mtime_ns=os.stat(os.path.join(output_folder, output_file)).st_mtime_ns)
+    if new_manifest != manifest:
+        save_install_manifest(output_folder, new_manifest)
+
+# Bulk writer for slow SD cards: all changed outputs are staged first and then written
+# in one go into a staging directory inside the output folder (so that the final
+# renames never cross file systems) with large writes, synced file by file, and
+# atomically renamed into place followed by a single fsync of the output folder. A crash
+# mid-install therefore never leaves a half-written file in the output folder.
+WRITE_BLOCK = 1024 * 1024
+STAGING_DIR = ".xevious_staging"
+
+class StagedWriter:
+    def __init__(self, output_folder, report=None):
+        self.output_folder = output_folder
+        self.report = report
+        self.staged = []
+        self.links = []
+
+    def stage(self, output_file, segments, roms):
+        self.staged.append((output_file, segments, roms))
+
+    def stage_bytes(self, output_file, data):
+        self.stage(output_file, [(output_file, 0, len(data))], {output_file: data})
+
+    def commit(self):
+        # Returns (files, bytes, seconds)
+        if not self.staged:
+            return 0, 0, 0.0
+        start = time.monotonic()
+        staging = os.path.join(self.output_folder, STAGING_DIR)
+        total = 0
+        fds = []
+        try:
+            # Files left behind by an interrupted install are removed first
+            if os.path.isdir(staging):
+                for name in os.listdir(staging):
+                    os.remove(os.path.join(staging, name))
+            os.makedirs(staging, exist_ok=True)
+            try:
+                for output_file, segments, roms in self.staged:
+                    fd = os.open(os.path.join(staging, output_file), os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+                    fds.append(fd)
+                    file_start = time.monotonic()
+                    written = write_segments(fd, segments, roms)
+                    if self.report is not None:
+                        self.report.file("write", output_file, time.monotonic() - file_start, bytes_written=written)
+                    total += written
+                # Only the staged files are synced, other cards written at the same time are not waited for
+                for fd in fds:
+                    getattr(os, "fdatasync", os.fsync)(fd)
+            finally:
+                for fd in fds:
+                    os.close(fd)
+            for output_file, segments, roms in self.staged:
+                os.replace(os.path.join(staging, output_file), os.path.join(self.output_folder, output_file))
+            os.rmdir(staging)
+        except OSError as e:
+            raise InstallError(f"Could not write to {self.output_folder}: {e}")
+        fsync_dir(self.output_folder)
+        self.staged = []
+        return len(fds), total, time.monotonic() - start
 
+    def commit_links(self):
+        # Creates the linked files, after the files they link to have been committed.
+        # Returns {method: amount of files}
+        methods = {}
+        for source, output_file in self.links:
+            method = link_file(source, os.path.join(self.output_folder, output_file))
+            methods[method] = methods.get(method, 0) + 1
+        if self.links:
+            fsync_dir(self.output_folder)
+        self.links = []
+        return methods
+
+# Identical output files of several variants are hardlinked where the file system
+# allows it, otherwise reflinked (copy-on-write clone, e.g. on Btrfs or XFS) or copied
+FICLONE = 0x40049409
+
+def link_file(source, destination):
+    # Returns "hardlinked", "reflinked" or "copied". FAT and exFAT cards support
+    # neither links nor clones and Windows has no fcntl, there the file is copied.
+    tmp_file = destination + ".tmp"
+    if os.path.lexists(tmp_file):
+        os.remove(tmp_file)
+    try:
+        os.link(source, tmp_file)
+        method = "hardlinked"
+    except (AttributeError, NotImplementedError, OSError):
+        with open(source, "rb") as src, open(tmp_file, "wb") as dst:
+            try:
+                import fcntl
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                method = "reflinked"
+            except (ImportError, AttributeError, OSError):
+                copy_file_range(src.fileno(), dst.fileno(), 0, os.fstat(src.fileno()).st_size)
+                method = "copied"
+            os.fsync(dst.fileno())
+    os.replace(tmp_file, destination)
+    return method
+
+def fsync_dir(path):
+    # Makes the renames durable, directories cannot be opened on Windows
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def write_segments(fd, segments, roms):
+    # Memory segments are coalesced into writes of up to WRITE_BLOCK bytes, file
+    # regions are copied kernel-side. Returns the amount of bytes written.
+    pending = []
+    pending_size = 0
+    total = 0
+    for part, start, end in segments:
+        source = roms[part]
+        if isinstance(source, FileRange):
+            if pending:
+                write_all(fd, b"".join(pending))
+                pending, pending_size = [], 0
+            copy_file_range_from(source, fd, start, end - start)
+        else:
+            pending.append(memoryview(source)[start:end])
+            pending_size += end - start
+            if pending_size >= WRITE_BLOCK:
+                write_all(fd, b"".join(pending))
+                pending, pending_size = [], 0
+        total += end - start
+    if pending:
+        write_all(fd, b"".join(pending))
+    return total
+
+def copy_file_range_from(source, fd, start, length):
+    with open(source.path, "rb") as src:
+        copy_file_range(src.fileno(), fd, source.offset + start, length)
+
+# FAT32 image mode (--image): instead of writing into a mounted SD card, the complete
+# core folder is written into a freshly formatted FAT32 volume within an image file,
+# in pure Python. All directories and files are laid out contiguously one after the
+# other, so that the image can be cloned to many cards at full sequential speed.
+#
+# A new image gets an MBR with one FAT32 (LBA) partition that starts at 1 MiB. Within
+# an existing image, the first FAT32 partition, a FAT32 volume without partition
+# table, or the region given by --image-offset is formatted.
+SECTOR = 512
+IMAGE_SIZE = 64 * 1024 * 1024
+IMAGE_PARTITION_START = 2048
+FAT32_RESERVED_SECTORS = 32
+FAT32_MIN_CLUSTERS = 65525
+FAT32_MAX_CLUSTERS = 0x0FFFFFF5
+FAT32_EOC = 0x0FFFFFFF
+FAT32_PARTITION_TYPES = (0x0B, 0x0C)
+ATTR_DIRECTORY = 0x10
+ATTR_ARCHIVE = 0x20
+ATTR_LFN = 0x0F
+SHORT_NAME_CHARS = set("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789$%'-_@~`!(){}^#&")
+
+FAT32_BOOT_SECTOR = struct.Struct("<3s8sHBHBHHBHHHIIIHHIHH12sBBBI11s8s")
+FAT32_DIR_ENTRY = struct.Struct("<11sBBBHHHHHHHI")
+FAT32_LFN_ENTRY = struct.Struct("<B10sBBB12sH4s")
+MBR_PARTITION_ENTRY = struct.Struct("<B3sB3sII")
+
+def fat32_geometry(total_sectors):
+    # Returns (sectors per cluster, sectors per FAT, amount of clusters) with the
+    # cluster sizes that Microsoft recommends for FAT32
+    sectors_per_cluster = 64
+    for limit, size in ((532480, 1), (16777216, 8), (33554432, 16), (67108864, 32)):
+        if total_sectors <= limit:
+            sectors_per_cluster = size
+            break
+    fat_sectors = -(-(total_sectors - FAT32_RESERVED_SECTORS) // ((256 * sectors_per_cluster + 2) // 2))
+    clusters = (total_sectors - FAT32_RESERVED_SECTORS - 2 * fat_sectors) // sectors_per_cluster
+    if not FAT32_MIN_CLUSTERS <= clusters <= FAT32_MAX_CLUSTERS:
+        raise InstallError(f"A FAT32 volume of {total_sectors * SECTOR / (1024 * 1024):.1f} MiB is not possible, "
+                           f"it needs at least {FAT32_MIN_CLUSTERS} clusters (about 33 MiB)")
+    return sectors_per_cluster, fat_sectors, clusters
+
+def find_image_volume(image_file):
+    # Returns (offset, size) in bytes of the FAT32 volume within an existing image
+    with open(image_file, "rb") as f:
+        sector = f.read(SECTOR)
+        image_size = f.seek(0, os.SEEK_END)
+    if len(sector) == SECTOR and sector[510:512] == b"\x55\xaa":
+        if sector[82:90] == b"FAT32   ":
+            return 0, image_size
+        for n in range(4):
+            status, chs_start, type, chs_end, lba, sectors = MBR_PARTITION_ENTRY.unpack_from(sector, 446 + n * 16)
+            if type in FAT32_PARTITION_TYPES and sectors:
+                return lba * SECTOR, sectors * SECTOR
+    raise InstallError(f"No FAT32 partition found in {image_file}, use --image-offset to select a region")
+
+def short_name(name, taken):
+    # Returns (8.3 name as 11 bytes, whether a long name is needed); taken holds the
+    # short names that are already used within the directory
+    base, ext = os.path.splitext(name)
+    base, ext = base.upper(), ext[1:].upper()
+    if 1 <= len(base) <= 8 and len(ext) <= 3 and set(base + ext) <= SHORT_NAME_CHARS:
+        entry = f"{base:8}{ext:3}".encode("ascii")
+        if entry not in taken:
+            return entry, name != name.upper()
+    base = "".join(c for c in base if c in SHORT_NAME_CHARS) or "_"
+    ext = "".join(c for c in ext if c in SHORT_NAME_CHARS)[:3]
+    n = 1
+    while True:
+        tail = f"~{n}"
+        entry = f"{base[:8 - len(tail)] + tail:8}{ext:3}".encode("ascii")
+        if entry not in taken:
+            return entry, True
+        n += 1
+
+def lfn_entries(name, short):
+    # Long name entries in on-disk order, i.e. the last part of the name first
+    checksum = 0
+    for byte in short:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + byte) & 0xFF
+    encoded = name.encode("utf-16-le")
+    if len(encoded) % 26:
+        encoded += b"\0\0" + b"\xff" * (24 - len(encoded) % 26)
+    parts = [encoded[i:i + 26] for i in range(0, len(encoded), 26)]
+    return [FAT32_LFN_ENTRY.pack(n | (0x40 if n == len(parts) else 0), part[0:10], ATTR_LFN, 0, checksum, part[10:22], 0, part[22:26])
+            for n, part in reversed(list(enumerate(parts, 1)))]
+
+def fat_datetime(timestamp):
+    t = time.localtime(timestamp)
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), (max(t.tm_year - 1980, 0) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+def write_fat32_volume(fd, offset, size, folder, files, report=None):
+    # Formats a FAT32 volume of size bytes at offset and writes the files, a list of
+    # (name, segments, roms), into folder. Returns the amount of file bytes written.
+    total_sectors = size // SECTOR
+    sectors_per_cluster, fat_sectors, clusters = fat32_geometry(total_sectors)
+    cluster_size = sectors_per_cluster * SECTOR
+    data_start = offset + (FAT32_RESERVED_SECTORS + 2 * fat_sectors) * SECTOR
+    now = time.time()
+    wtime, wdate = fat_datetime(now)
+    volume_id = int(now * 1000) & 0xFFFFFFFF
+
+    # One directory per level of folder, each one containing the next one and the
+    # last one containing the files; the root directory has no dot entries
+    names = [c for c in folder.replace("\\", "/").split("/") if c]
+    sizes = [sum(end - start for part, start, end in segments) for name, segments, roms in files]
+    levels = []
+    for level in range(len(names) + 1):
+        children = [(names[level], None)] if level < len(names) else list(zip([f[0] for f in files], sizes))
+        taken = {b".          ", b"..         "}
+        entries = []
+        for name, file_size in children:
+            short, needs_lfn = short_name(name, taken)
+            taken.add(short)
+            entries.append((name, short, lfn_entries(name, short) if needs_lfn else [], file_size))
+        count = (2 if level else 0) + sum(1 + len(lfn) for name, short, lfn, file_size in entries)
+        levels.append((entries, max(1, -(-count * 32 // cluster_size))))
+
+    # Contiguous allocation: the directories first, then the files
+    fat = array("I", [0x0FFFFFF8, FAT32_EOC])
+    def allocate(count):
+        first = len(fat)
+        fat.extend(range(first + 1, first + count))
+        fat.append(FAT32_EOC)
+        return first
+    dir_clusters = [allocate(count) for entries, count in levels]
+    file_clusters = [allocate(-(-file_size // cluster_size)) if file_size else 0 for file_size in sizes]
+    if len(fat) - 2 > clusters:
+        raise InstallError("The files do not fit into the FAT32 volume")
+
+    def dir_entry(short, attr, cluster, file_size=0):
+        return FAT32_DIR_ENTRY.pack(short, attr, 0, 0, wtime, wdate, wdate, cluster >> 16, wtime, wdate, cluster & 0xFFFF, file_size)
+
+    # Reserved sectors: boot sector, FSInfo and their backups at sector 6 and 7
+    boot = bytearray(SECTOR)
+    FAT32_BOOT_SECTOR.pack_into(boot, 0, b"\xeb\x58\x90", b"MSWIN4.1", SECTOR, sectors_per_cluster, FAT32_RESERVED_SECTORS,
+                                2, 0, 0, 0xF8, 0, 63, 255, offset // SECTOR, total_sectors, fat_sectors, 0, 0, 2, 1, 6,
+                                bytes(12), 0x80, 0, 0x29, volume_id, b"NO NAME    ", b"FAT32   ")
+    boot[510:512] = b"\x55\xaa"
+    fsinfo = bytearray(SECTOR)
+    struct.pack_into("<I", fsinfo, 0, 0x41615252)
+    struct.pack_into("<III", fsinfo, 484, 0x61417272, clusters - (len(fat) - 2), len(fat))
+    struct.pack_into("<I", fsinfo, 508, 0xAA550000)
+    reserved = bytearray(FAT32_RESERVED_SECTORS * SECTOR)
+    for sector, data in ((0, boot), (1, fsinfo), (6, boot), (7, fsinfo)):
+        reserved[sector * SECTOR:(sector + 1) * SECTOR] = data
+    os.lseek(fd, offset, os.SEEK_SET)
+    write_all(fd, reserved)
+
+    # Both FATs, the unused rest of which is cleared
+    if sys.byteorder != "little":
+        fat.byteswap()
+    used = fat.tobytes()
+    for copy in range(2):
+        os.lseek(fd, offset + (FAT32_RESERVED_SECTORS + copy * fat_sectors) * SECTOR, os.SEEK_SET)
+        write_all(fd, used)
+        for pos in range(len(used), fat_sectors * SECTOR, WRITE_BLOCK):
+            write_all(fd, bytes(min(WRITE_BLOCK, fat_sectors * SECTOR - pos)))
+
+    # Directories
+    for level, (entries, count) in enumerate(levels):
+        data = bytearray()
+        if level:
+            data += dir_entry(b".          ", ATTR_DIRECTORY, dir_clusters[level])
+            data += dir_entry(b"..         ", ATTR_DIRECTORY, dir_clusters[level - 1] if level > 1 else 0)
+        for n, (name, short, lfn, file_size) in enumerate(entries):
+            data += b"".join(lfn)
+            if file_size is None:
+                data += dir_entry(short, ATTR_DIRECTORY, dir_clusters[level + 1])
+            else:
+                data += dir_entry(short, ATTR_ARCHIVE, file_clusters[n], file_size)
+        os.lseek(fd, data_start + (dir_clusters[level] - 2) * cluster_size, os.SEEK_SET)
+        write_all(fd, data + bytes(count * cluster_size - len(data)))
+
+    # Files
+    total = 0
+    for (name, segments, roms), cluster in zip(files, file_clusters):
+        if not cluster:
+            continue
+        print(f"Writing {'/'.join([''] + names + [name])}")
+        file_start = time.monotonic()
+        os.lseek(fd, data_start + (cluster - 2) * cluster_size, os.SEEK_SET)
+        written = write_segments(fd, segments, roms)
+        if report is not None:
+            report.file("write", name, time.monotonic() - file_start, bytes_written=written)
+        total += written
+    return total
+
+def write_mbr(fd, start_sector, sectors):
+    # An MBR with a single FAT32 (LBA) partition
+    mbr = bytearray(SECTOR)
+    struct.pack_into("<I", mbr, 440, int(time.time()) & 0xFFFFFFFF)
+    MBR_PARTITION_ENTRY.pack_into(mbr, 446, 0x00, b"\xfe\xff\xff", 0x0C, b"\xfe\xff\xff", start_sector, sectors)
+    mbr[510:512] = b"\x55\xaa"
+    os.lseek(fd, 0, os.SEEK_SET)
+    write_all(fd, mbr)
+
+def load_romset(rom_zip_path, reverify, cache_file, variant, report):
+    # Returns (variant, roms) of a verified or identified romset
+    register_dat_variants(ROMSET_DB_FILE)
+
+    # The romset name of the zip (or the --variant option) selects the fast path that
+    # only reads the expected entries; everything else is identified by content.
+    if variant is not None and variant not in VARIANTS:
+        raise InstallError(f"Unknown variant {variant}, supported are: {', '.join(VARIANTS)}")
+    romset_name = variant or os.path.splitext(os.path.basename(os.path.normpath(rom_zip_path)))[0]
+
+    # With --reverify the cache is not consulted but still refreshed
+    cache = load_verify_cache(cache_file)
+    forget = os.path.abspath(rom_zip_path) + "|" if reverify else None
+    if reverify:
+        cache = {k: v for k, v in cache.items() if not k.startswith(forget)}
+
+    with report.phase("verify") as phase:
+        if os.path.isdir(rom_zip_path):
+            print(f"Identifying romset in folder {rom_zip_path}...")
+            variant, roms = identify_romset(hash_dir_entries(rom_zip_path, report), romset_name)
+        else:
+            try:
+                with zipfile.ZipFile(rom_zip_path, 'r') as zip_ref:
+                    names = set(zip_ref.namelist())
+                    if romset_name in VARIANTS and all(f in names for f in VARIANTS[romset_name][0]):
+                        # Only the expected entries are read, straight out of the zip:
+                        # each one is decompressed and hashed once and then written from memory.
+                        variant = romset_name
+                        EXPECTED_FILES, EXPECTED_CHKSM, layout = VARIANTS[variant]
+                        print("Verifying checksums...")
+                        roms = verify_checksums(zip_ref,EXPECTED_CHKSM,EXPECTED_FILES,cache,report)
+                    else:
+                        print("Identifying romset by checksums...")
+                        variant, roms = identify_romset(hash_zip_entries(zip_ref, cache, report), romset_name)
+                save_verify_cache(cache_file, cache, forget)
+
+            except FileNotFoundError:
+                raise InstallError(f"ZIP file not found: {rom_zip_path}")
+            except zipfile.BadZipFile:
+                raise InstallError(f"Invalid or corrupted ZIP file: {rom_zip_path}")
+        phase["bytes_read"] = sum(f["bytes_read"] for f in report.files)
+    report.variant = variant
+    return variant, roms
+
+def install(rom_zip_path, output_folder, reverify=False, cache_file=VERIFY_CACHE_FILE, variant=None, force=False, report=None):
+    if report is None:
+        report = InstallReport()
+    variant, roms = load_romset(rom_zip_path, reverify, cache_file, variant, report)
+    layout = VARIANTS[variant][2]
+
+    if not os.path.exists(output_folder):
+        print(f"Creating output folder: {output_folder}")
+        os.makedirs(output_folder)
+
+    print("Merging files and copying to output folder...\n")
+    with report.phase("plan"):
+        plan = compile_plan(layout, roms)
+        writer = StagedWriter(output_folder, report)
+        expected = execute_plan(plan, roms, writer, force)
+        changed = len(writer.staged)
+
+        stage_config(writer, force)
+
+    with report.phase("write") as phase:
+        files, total, seconds = writer.commit()
+        update_install_manifest(output_folder, expected)
+        phase["bytes_written"] = total
+    print(f"\nFiles extracted and merged successfully ({changed} of {len(plan)} files written).")
+    if files:
+        print(f"Wrote {files} files, {total / 1024:.1f} KiB in {seconds:.3f}s ({total / max(seconds, 1e-6) / 1e6:.2f} MB/s)")
+    return report
+
+def stage_config(writer, force=False):
+    # Creates the config file, an existing one holds the user's saved settings. It is
+    # never shared between output folders.
+    dir_start, cfg_name, cfg_size = core_config_spec()
+    output_file_path = os.path.join(writer.output_folder, cfg_name)
+    if os.path.isfile(output_file_path) and os.path.getsize(output_file_path) == cfg_size and not force:
+        print(f"\nKeeping existing {cfg_name} file")
+    else:
+        print(f"\nCreating {cfg_name} file")
+        writer.stage_bytes(cfg_name, bytes([0xff]) * cfg_size)
+
+# Multi-variant install (--all-variants): a merged MAME set, or a folder with the zips
+# of a split set (or with loose ROM files), is read in a single pass and every complete
+# variant is installed into <output_root>/<variant>. Every part is decompressed and
+# hashed once, even if several zips contain it, and output files with the same content
+# are written once and linked into the other output folders.
+
+def load_all_romsets(source, reverify, cache_file, report):
+    # Returns {variant: roms} of all complete variants
+    register_dat_variants(ROMSET_DB_FILE)
+    cache = load_verify_cache(cache_file)
+    hashed = []
+    with report.phase("verify") as phase:
+        if os.path.isdir(source):
+            zips = sorted(os.path.join(source, name) for name in os.listdir(source) if name.lower().endswith(".zip"))
+            print(f"Identifying romsets in folder {source}...")
+            hashed += hash_dir_entries(source, report)
+        else:
+            zips = [source]
+        # With --reverify only the entries of the zips read here are dropped
+        forget = tuple(os.path.abspath(zip_path) + "|" for zip_path in zips) if reverify else None
+        if forget:
+            cache = {k: v for k, v in cache.items() if not k.startswith(forget)}
+        seen = set()
+        for zip_path in zips:
+            print(f"Identifying romsets in {zip_path}...")
+            try:
+                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                    hashed += hash_zip_entries(zip_ref, cache, report, seen)
+            except FileNotFoundError:
+                raise InstallError(f"ZIP file not found: {zip_path}")
+            except zipfile.BadZipFile:
+                raise InstallError(f"Invalid or corrupted ZIP file: {zip_path}")
+        save_verify_cache(cache_file, cache, forget)
+        phase["bytes_read"] = sum(f["bytes_read"] for f in report.files)
+
+    found, entry_names, complete = match_variants(hashed)
+    if not complete:
+        closest = max(VARIANTS, key=lambda v: len(found[v]))
+        missing = [part for part in VARIANTS[closest][0] if part not in found[closest]]
+        raise InstallError(f"No complete romset found, closest match is {closest}, "
+                           f"missing or bad: {', '.join(missing)}")
+    print(f"Identified romsets: {', '.join(complete)}")
+    return {variant: found[variant] for variant in complete}
+
+def install_all(source, output_root, reverify=False, cache_file=VERIFY_CACHE_FILE, force=False, report=None):
+    if report is None:
+        report = InstallReport()
+    romsets = load_all_romsets(source, reverify, cache_file, report)
+    report.variant = ",".join(romsets)
+
+    shared = {}
+    writers = []
+    with report.phase("plan"):
+        for variant, roms in romsets.items():
+            output_folder = os.path.join(output_root, variant)
+            os.makedirs(output_folder, exist_ok=True)
+            title = f"{variant}: {output_folder}"
+            print(f"\n{title}\n{'=' * len(title)}")
+            plan = compile_plan(VARIANTS[variant][2], roms)
+            writer = StagedWriter(output_folder, report)
+            expected = execute_plan(plan, roms, writer, force, shared)
+            stage_config(writer, force)
+            writers.append((writer, expected))
+
+    with report.phase("write") as phase:
+        files = total = 0
+        methods = {}
+        start = time.monotonic()
+        # All files are committed before any link is created, links may point into
+        # any of the output folders
+        for writer, expected in writers:
+            written, written_bytes, seconds = writer.commit()
+            files += written
+            total += written_bytes
+        for writer, expected in writers:
+            for method, count in writer.commit_links().items():
+                methods[method] = methods.get(method, 0) + count
+            update_install_manifest(writer.output_folder, expected)
+        seconds = time.monotonic() - start
+        phase["bytes_written"] = total
+
+    print(f"\nInstalled {len(romsets)} variants into {output_root}.")
+    print(f"Wrote {files} files, {total / 1024:.1f} KiB in {seconds:.3f}s ({total / max(seconds, 1e-6) / 1e6:.2f} MB/s)")
+    if methods:
+        print(f"Shared {sum(methods.values())} identical files: " + ", ".join(f"{count} {method}" for method, count in methods.items()))
+    return report
+
+def install_image(rom_zip_path, image_file, image_size=None, image_offset=None, reverify=False, cache_file=VERIFY_CACHE_FILE,
+                  variant=None, report=None, format_image=False):
+    # image_size is the size of a new image file, or with image_offset the size of the
+    # region to format (default: up to the end of the image). An existing image is
+    # only formatted with format_image, as all files on its volume are lost.
+    if os.path.isfile(image_file) and not format_image:
+        raise InstallError(f"{image_file} already exists, use --format-image to format its FAT32 volume "
+                           f"(all files on it are lost)")
+    if report is None:
+        report = InstallReport()
+    variant, roms = load_romset(rom_zip_path, reverify, cache_file, variant, report)
+    dir_start, cfg_name, cfg_size = core_config_spec()
+
+    with report.phase("plan"):
+        plan = compile_plan(VARIANTS[variant][2], roms)
+        files = [(output_file, segments, roms) for section, output_file, message, segments in plan]
+        files.append((cfg_name, [(cfg_name, 0, cfg_size)], {cfg_name: bytes([0xff]) * cfg_size}))
+
+        exists = os.path.isfile(image_file)
+        if exists:
+            image_end = os.path.getsize(image_file)
+            if image_offset is None:
+                offset, size = find_image_volume(image_file)
+            else:
+                offset, size = image_offset, image_size or image_end - image_offset
+            if offset % SECTOR or offset < 0 or offset + size > image_end:
+                raise InstallError(f"The region at offset {offset} with {size} bytes is not within {image_file} "
+                                   f"or not aligned to {SECTOR} byte sectors")
+        else:
+            image_end = image_size or IMAGE_SIZE
+            offset = IMAGE_PARTITION_START * SECTOR if image_offset is None else image_offset
+            size = image_end - offset
+            if offset % SECTOR or size <= 0:
+                raise InstallError(f"An image of {image_end} bytes cannot hold a volume at offset {offset}")
+
+    with report.phase("write") as phase:
+        print(f"{'Formatting' if exists else 'Creating'} FAT32 volume of {size / (1024 * 1024):.1f} MiB "
+              f"at offset {offset} in {image_file}\n")
+        start = time.monotonic()
+        fd = os.open(image_file, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o666)
+        try:
+            if not exists:
+                os.ftruncate(fd, image_end)
+                if image_offset is None:
+                    write_mbr(fd, offset // SECTOR, size // SECTOR)
+            total = write_fat32_volume(fd, offset, size, dir_start, files, report)
+            os.fsync(fd)
+        except BaseException:
+            os.close(fd)
+            if not exists:
+                os.remove(image_file)
+            raise
+        os.close(fd)
+        seconds = time.monotonic() - start
+        phase["bytes_written"] = total
+    print(f"\nFiles extracted and merged successfully into {image_file} ({len(files)} files in {dir_start}).")
+    print(f"Wrote {len(files)} files, {total / 1024:.1f} KiB in {seconds:.3f}s ({total / max(seconds, 1e-6) / 1e6:.2f} MB/s)")
+    return report
+
+# Batch mode: installs many romsets into many output folders on a process pool.
+# A batch source is either a directory of zips (each one is installed into
+# <output_root>/<zip name without .zip>) or a manifest text file with one
+# "<zip>, <output_folder>" pair per line. Relative paths in a manifest are relative
+# to the manifest itself, empty lines and lines starting with # are ignored.
+
+def read_batch_jobs(source, output_root):
+    jobs = []
+    if os.path.isdir(source):
+        if output_root is None:
+            raise InstallError("Batch mode with a directory of zips needs an output root folder")
+        for name in sorted(os.listdir(source)):
+            if name.lower().endswith(".zip") or os.path.isdir(os.path.join(source, name)):
+                jobs.append((os.path.join(source, name), os.path.join(output_root, os.path.splitext(name)[0])))
+        return jobs
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, "r") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = [field.strip() for field in line.split(",")]
+            if len(fields) != 2 or not all(fields):
+                raise InstallError(f"{source}:{line_no}: expected '<zip>, <output_folder>'")
+            zip_path, target = (os.path.join(base, field) for field in fields)
+            if output_root is not None and not os.path.isabs(fields[1]):
+                target = os.path.join(output_root, fields[1])
+            jobs.append((zip_path, target))
+    return jobs
+
+def run_batch_job(job, reverify, cache_file, variant=None, force=False):
+    # Runs in a worker process: the progress output of the install is captured
+    # so that the parallel jobs do not interleave on the console.
+    rom_zip_path, output_folder = job
+    start = time.monotonic()
+    log = io.StringIO()
+    report = InstallReport()
+    try:
+        with contextlib.redirect_stdout(log):
+            install(rom_zip_path, output_folder, reverify, cache_file, variant, force, report)
+        result = "OK"
+    except InstallError as e:
+        result = f"FAILED: {e}"
     except Exception as e:
-        print("Error:", str(e))
+        result = f"FAILED: {type(e).__name__}: {e}"
+    return rom_zip_path, output_folder, result, time.monotonic() - start, report.as_dict()
+
+def run_batch(source, output_root, jobs_count, reverify, cache_file, variant=None, force=False, report_format=None):
+    jobs = read_batch_jobs(source, output_root)
+    if not jobs:
+        raise InstallError(f"No romsets found in {source}")
+    if report_format == "json":
+        log = io.StringIO()
+    else:
+        log = sys.stdout
+    print(f"Installing {len(jobs)} romsets using up to {jobs_count} worker processes...\n", file=log)
+
+    with ProcessPoolExecutor(max_workers=jobs_count) as pool:
+        results = list(pool.map(run_batch_job, jobs, [reverify] * len(jobs), [cache_file] * len(jobs), [variant] * len(jobs), [force] * len(jobs)))
+
+    zip_width = max(len("ZIP file"), *(len(r[0]) for r in results))
+    out_width = max(len("Output folder"), *(len(r[1]) for r in results))
+    print(f"{'ZIP file':<{zip_width}}  {'Output folder':<{out_width}}  {'Time':>7}  Result", file=log)
+    print(f"{'-' * zip_width}  {'-' * out_width}  {'-' * 7}  {'-' * 6}", file=log)
+    for rom_zip_path, output_folder, result, seconds, report in results:
+        print(f"{rom_zip_path:<{zip_width}}  {output_folder:<{out_width}}  {seconds:6.2f}s  {result}", file=log)
+
+    failed = sum(1 for r in results if r[2] != "OK")
+    print(f"\n{len(results) - failed} of {len(results)} romsets installed successfully.", file=log)
+    if report_format == "json":
+        print(json.dumps({"jobs": [{"zip": r[0], "output_folder": r[1], "result": r[2], "seconds": r[3], "report": r[4]}
+                                   for r in results]}, indent=1))
+    return failed == 0
+
+# Watch mode (--watch): a long-running service for provisioning stations. The drop
+# folder is polled for new or changed zips; a zip is only installed once its size and
+# mtime did not change for WATCH_DEBOUNCE seconds, so that partial uploads are not
+# picked up. Installs run on a bounded pool of worker processes, each zip into
+# <output_root>/<zip name> or into the folder given for it in a --targets manifest
+# (same format as a batch manifest). The queue depth, the running jobs and a summary
+# of the last jobs are written to a JSON status file whenever one of them changes and,
+# with --status-port, served on http://127.0.0.1:<port>/.
+WATCH_POLL = 1.0
+WATCH_DEBOUNCE = 5.0
+WATCH_HISTORY = 100
+WATCH_STATUS_FILE = ".xevious_watch_status.json"
+
+class WatchService:
+    def __init__(self, drop_folder, output_root=None, jobs_count=1, targets=None, status_file=None, status_port=None,
+                 debounce=WATCH_DEBOUNCE, poll=WATCH_POLL, reverify=False, cache_file=VERIFY_CACHE_FILE, force=False):
+        self.drop_folder = drop_folder
+        self.output_root = output_root
+        self.jobs_count = jobs_count
+        self.targets = targets or {}
+        self.status_file = status_file or os.path.join(drop_folder, WATCH_STATUS_FILE)
+        self.status_port = status_port
+        self.debounce = debounce
+        self.poll = poll
+        self.install_args = (reverify, cache_file, None, force)
+        self.seen = {}          # zip path: (signature, monotonic time since when it is unchanged)
+        self.installed = {}     # zip path: signature of the last install
+        self.active = set()     # zip paths that are queued or running
+        self.running = {}       # zip path: start time
+        self.history = []
+        self.queue = None
+        self.started = time.time()
+        self.written = None     # state of the last status file, see write_status
+
+    def target(self, zip_path):
+        name = os.path.basename(zip_path)
+        if name in self.targets:
+            return self.targets[name]
+        if self.output_root is None:
+            return None
+        return os.path.join(self.output_root, os.path.splitext(name)[0])
+
+    def scan(self):
+        # Returns the zips that are complete and not installed in their current state
+        now = time.monotonic()
+        ready = []
+        try:
+            names = os.listdir(self.drop_folder)
+        except OSError:
+            names = []
+        current = set()
+        for name in sorted(names):
+            zip_path = os.path.join(self.drop_folder, name)
+            if not name.lower().endswith(".zip"):
+                continue
+            try:
+                st = os.stat(zip_path)
+            except OSError:
+                continue
+            current.add(zip_path)
+            signature = (st.st_size, st.st_mtime_ns)
+            if self.seen.get(zip_path, (None,))[0] != signature:
+                self.seen[zip_path] = (signature, now)
+            elif now - self.seen[zip_path][1] >= self.debounce and self.installed.get(zip_path) != signature \
+                    and zip_path not in self.active:
+                ready.append((zip_path, signature))
+        for zip_path in set(self.seen) - current:
+            del self.seen[zip_path]
+            self.installed.pop(zip_path, None)
+        return ready
+
+    def status(self):
+        return {
+            "drop_folder": self.drop_folder,
+            "uptime": round(time.time() - self.started, 3),
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "waiting": sorted(p for p, (signature, since) in self.seen.items()
+                              if self.installed.get(p) != signature and p not in self.active),
+            "running": [{"zip": p, "seconds": round(time.monotonic() - start, 3)} for p, start in self.running.items()],
+            "jobs": self.history,
+        }
+
+    def write_status(self):
+        # Only written when the state changed, the status file is often on an SD card.
+        # The uptime and the seconds of the running jobs do not count as a change.
+        status = self.status()
+        state = json.dumps([status["queue_depth"], status["waiting"], sorted(self.running), status["jobs"]])
+        if state == self.written:
+            return
+        tmp_file = f"{self.status_file}.tmp"
+        try:
+            with open(tmp_file, "w") as f:
+                json.dump(status, f, indent=1)
+            os.replace(tmp_file, self.status_file)
+            self.written = state
+        except OSError as e:
+            print(f"Warning: could not write the status file {self.status_file}: {e}")
+
+    async def worker(self, pool):
+        loop = asyncio.get_running_loop()
+        while True:
+            zip_path, signature = await self.queue.get()
+            output_folder = self.target(zip_path)
+            self.running[zip_path] = time.monotonic()
+            self.write_status()
+            print(f"{time.strftime('%H:%M:%S')} Installing {zip_path} into {output_folder}")
+            try:
+                result = await loop.run_in_executor(pool, run_batch_job, (zip_path, output_folder), *self.install_args)
+            except Exception as e:
+                result = (zip_path, output_folder, f"FAILED: {type(e).__name__}: {e}", time.monotonic() - self.running[zip_path], None)
+            rom_zip_path, output_folder, message, seconds, report = result
+            # A failed zip is not retried until it changes
+            self.installed[zip_path] = signature
+            self.active.discard(zip_path)
+            del self.running[zip_path]
+            # Only a summary of the install report is kept, the status file is rewritten for every job
+            self.history = (self.history + [{"zip": rom_zip_path, "output_folder": output_folder, "result": message,
+                                             "seconds": round(seconds, 3), "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                                             "romset": report and report["variant"],
+                                             "bytes_read": report and report["bytes_read"],
+                                             "bytes_written": report and report["bytes_written"]}])[-WATCH_HISTORY:]
+            print(f"{time.strftime('%H:%M:%S')} {rom_zip_path}: {message} ({seconds:.2f}s)")
+            self.write_status()
+            self.queue.task_done()
+
+    async def serve_status(self, reader, writer):
+        # Minimal HTTP: every request is answered with the status as JSON
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        body = json.dumps(self.status(), indent=1).encode()
+        writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: application/json\r\n"
+                     b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body) + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def run(self, stop=None):
+        # Runs until the stop event (an asyncio.Event) is set, or forever
+        stop = stop or asyncio.Event()
+        self.queue = asyncio.Queue()
+        server = None
+        if self.status_port is not None:
+            server = await asyncio.start_server(self.serve_status, "127.0.0.1", self.status_port)
+            self.status_port = server.sockets[0].getsockname()[1]
+            print(f"Status on http://127.0.0.1:{self.status_port}/")
+        print(f"Watching {self.drop_folder} with {self.jobs_count} workers, status in {self.status_file}")
+        with ProcessPoolExecutor(max_workers=self.jobs_count) as pool:
+            workers = [asyncio.create_task(self.worker(pool)) for _ in range(self.jobs_count)]
+            try:
+                while not stop.is_set():
+                    for zip_path, signature in self.scan():
+                        if self.target(zip_path) is None:
+                            print(f"{time.strftime('%H:%M:%S')} Skipping {zip_path}, no target folder configured")
+                            self.installed[zip_path] = signature
+                            continue
+                        self.active.add(zip_path)
+                        await self.queue.put((zip_path, signature))
+                        print(f"{time.strftime('%H:%M:%S')} Queued {zip_path}")
+                    self.write_status()
+                    try:
+                        await asyncio.wait_for(stop.wait(), self.poll)
+                    except asyncio.TimeoutError:
+                        pass
+                await self.queue.join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                if server is not None:
+                    server.close()
+                    await server.wait_closed()
+                self.write_status()
+
+def run_watch(drop_folder, output_root, jobs_count, targets_file=None, status_file=None, status_port=None,
+              debounce=WATCH_DEBOUNCE, reverify=False, cache_file=VERIFY_CACHE_FILE, force=False):
+    if not os.path.isdir(drop_folder):
+        raise InstallError(f"Drop folder not found: {drop_folder}")
+    targets = {}
+    if targets_file is not None:
+        try:
+            targets = {os.path.basename(zip_path): target for zip_path, target in read_batch_jobs(targets_file, output_root)}
+        except OSError as e:
+            raise InstallError(f"Could not read {targets_file}: {e}")
+    if output_root is None and not targets:
+        raise InstallError("Watch mode needs an output root folder or a --targets manifest")
+    service = WatchService(drop_folder, output_root, jobs_count, targets, status_file, status_port, debounce,
+                           reverify=reverify, cache_file=cache_file, force=force)
+    try:
+        asyncio.run(service.run())
+    except KeyboardInterrupt:
+        print("Stopped watching")
 
 
 def main():
 
-    # set pointer to particular version of Bosconian.
-    EXPECTED_FILES = ""
-    EXPECTED_CHKSM = {}
-    
-    print("Xevious for MEGA65: ROM Installer")
-    print("=================================\n")
-    if len(sys.argv) != 3:
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("rom_zip_path", nargs="?")
+    parser.add_argument("output_folder", nargs="?")
+    parser.add_argument("--reverify", action="store_true")
+    parser.add_argument("--cache-file", default=VERIFY_CACHE_FILE)
+    parser.add_argument("--batch", action="store_true")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--variant")
+    parser.add_argument("--force", action="store_true")
+    parser.add_argument("--report", choices=["json", "summary"])
+    parser.add_argument("--quiet", action="store_true")
+    parser.add_argument("--all-variants", action="store_true")
+    parser.add_argument("--block-table")
+    parser.add_argument("--import-dat", action="store_true")
+    parser.add_argument("--audit", action="store_true")
+    parser.add_argument("--romset-db")
+    parser.add_argument("--make-block-table", action="store_true")
+    parser.add_argument("--watch", action="store_true")
+    parser.add_argument("--targets")
+    parser.add_argument("--status-file")
+    parser.add_argument("--status-port", type=int)
+    parser.add_argument("--debounce", type=float, default=WATCH_DEBOUNCE)
+    parser.add_argument("--image")
+    parser.add_argument("--image-size", type=int)
+    parser.add_argument("--image-offset", type=lambda value: int(value, 0))
+    parser.add_argument("--format-image", action="store_true")
+    args = parser.parse_args()
+    # The JSON report has to be the only output to be machine-readable
+    if args.report == "json":
+        args.quiet = True
+
+    if not args.quiet:
+        print("Xevious for MEGA65: ROM Installer")
+        print("=================================\n")
+    if args.rom_zip_path is None or (args.output_folder is None and not (args.batch or args.image or args.watch or args.make_block_table or
+                                                                 args.import_dat or args.audit)) or \
+       (args.image and (args.batch or args.all_variants or args.output_folder is not None)) or \
+       (args.format_image and not args.image) or \
+       (args.all_variants and (args.batch or args.variant)) or \
+       (args.watch and (args.batch or args.image or args.all_variants or args.variant)):
         print("The Xevious core expects the files generated by this script located in the folder /arcade/xevious on your SD card.")
         print("This script supports the following versions of Xevious.\n")
         print("xevious           Xevious (Namco)                           (Namco, 1982)")
         print("xeviousa          Xevious (Atari, harder)                   (Namco (Atari license), 1982)")
         print("xeviousc          Xevious (Atari, Namco PCB)                (Namco (Atari license), 1982)")
         print("sxeviousj         Super Xevious (Japan)                     (Namco, 1984)")
-        print("Usage: script.py <path to the zip file> <output_folder>")
+        print("Usage: script.py [--reverify] [--force] [--cache-file <file>] [--variant <name>] <path to the zip file or folder> <output_folder>")
+        print("       script.py --batch [--jobs <n>] <folder with zips | manifest> [<output_root>]")
+        print("       script.py --all-variants [--force] <merged zip | folder with a split set> <output_root>")
+        print("       script.py --watch [--jobs <n>] [--targets <manifest>] [--status-file <file>] [--status-port <port>]")
+        print("                 [--debounce <seconds>] <drop folder> [<output_root>]")
+        print("       script.py --import-dat [--romset-db <file>] <MAME XML or ClrMamePro DAT file>")
+        print("       script.py --audit [--romset-db <file>] <path to the zip file or folder>")
+        print("       script.py --make-block-table [--block-table <file>] <known-good zip or folder>")
+        print("       script.py --image <image file> [--format-image] [--image-size <MiB>] [--image-offset <bytes>] <path to the zip file or folder>")
+        print("  --reverify      Ignore the verification cache and hash every ROM part again")
+        print("  --force         Rewrite all output files and reset xevcfg, even if they are up to date")
+        print("  --batch         Install every zip of a folder into <output_root>/<zip name>, or every")
+        print("                  '<zip>, <output_folder>' line of a manifest file, in parallel")
+        print("  --jobs <n>      Amount of parallel worker processes in batch mode")
+        print("  --variant <v>   Install this variant, e.g. from a merged MAME set. By default the variant")
+        print("                  is taken from the zip name or identified by the checksums of its content")
+        print("  --report <fmt>  Print phase timings and throughput as 'json' or as a 'summary' line")
+        print("  --quiet         Do not print the per-file progress (implied by --report json)")
+        print("  --all-variants  Install every complete variant of a merged or split MAME set into")
+        print("                  <output_root>/<variant>, identical files are written once and linked")
+        print("  --watch         Keep watching the drop folder and install every new or changed zip into")
+        print("                  <output_root>/<zip name> or the folder given for it in the --targets")
+        print("                  manifest, once it did not change for --debounce seconds (default: 5)")
+        print("  --status-file   JSON file with queue depth and job timings in watch mode (default: in")
+        print("                  the drop folder), --status-port also serves it on http://127.0.0.1:<port>/")
+        print("  --import-dat    Import the romsets of a DAT file into the romset database. Imported sets")
+        print("                  with the ROM names and sizes of a supported variant can be installed")
+        print("  --audit         Match every file of a zip or folder against all imported romsets")
+        print("  --romset-db     Romset database to use (default: romsets.sqlite in the cache folder)")
+        print("  --make-block-table  Add the known-good parts of a set to the block hash table, which")
+        print("                  localizes the bad regions of parts that fail verification later")
+        print("  --block-table   Block hash table to use (default: xevious_rom_blocks.json next to this script)")
+        print("  --image <file>  Write the core folder into a FAT32 SD card image instead of a mounted card.")
+        print("                  A new image gets one partition, in an existing image the first FAT32")
+        print("                  partition is formatted, which needs --format-image")
+        print("  --format-image  Allow formatting the volume of an existing image (all files on it are lost)")
+        print("  --image-size    Size of a new image in MiB (default: 64), or with --image-offset the size")
+        print("                  of the region to format")
+        print("  --image-offset  Format the region at this byte offset of the image instead")
         sys.exit(1)
-      
-    filename=""
-    if len(sys.argv) > 1:
-        argument_value = sys.argv[1]
-        fileName = os.path.split(argument_value)[1]
-        if fileName == "xevious.zip":             # Xevious (Namco)                    (Namco, 1982)
-            EXPECTED_FILES=NAMCO_FILES
-            EXPECTED_CHKSM=NAMCO_CHK
-        elif fileName == "xeviousc.zip":          # Xevious (Atari, Namco PCB)         (Namco (Atari license), 1982)
-            EXPECTED_FILES=ANAMCO_FILES
-            EXPECTED_CHKSM=ANAMCO_CHK
-        elif fileName == "sxeviousj.zip":         # Super Xevious (Japan)              (Namco, 1984)
-            EXPECTED_FILES=SUPERX_FILES
-            EXPECTED_CHKSM=SUPERX_CHK     
-        elif fileName == "xeviousa.zip":          # Xevious (Atari, harder)            (Namco (Atari license), 1982)
-            EXPECTED_FILES=ATARI2_FILES
-            EXPECTED_CHKSM=ATARI2_CHK     
-            
-        else:
-            print ("No match found for",sys.argv[1],"\n")
-            return
-    
 
-    rom_zip_path =  sys.argv[1]
-    output_folder = sys.argv[2]
+    global BLOCK_TABLE_FILE, ROMSET_DB_FILE
+    if args.block_table:
+        BLOCK_TABLE_FILE = args.block_table
+    if args.romset_db:
+        ROMSET_DB_FILE = args.romset_db
 
-    if not os.path.exists(output_folder):
-        print(f"Creating output folder: {output_folder}")
-        os.makedirs(output_folder)
-  
-    with tempfile.TemporaryDirectory() as temp_dir:
-        print(f"Extracting files to temporary directory: {temp_dir}")
-        try:
-            with zipfile.ZipFile(rom_zip_path, 'r') as zip_ref:
-                zip_ref.extractall(temp_dir)
-                missing_files = [f for f in EXPECTED_FILES if not os.path.isfile(os.path.join(temp_dir, f))]
-                if missing_files:
-                    print(f"Error: Missing files in the provided zip file: {', '.join(missing_files)}")
-                    sys.exit(1)
-                print("Verifying checksums...")
-                verify_checksums(temp_dir,EXPECTED_CHKSM,EXPECTED_FILES)
-                
-                
-                print("Merging files and copying to output folder...\n\n")
-                # rom1
-                print("Preparing ROM 1")
-                print("---------------")
-                if fileName != "xeviousa.zip":
-                    with open(os.path.join(output_folder, "rom1.rom"), "wb") as rom1:
-                        for part in [EXPECTED_FILES[0], EXPECTED_FILES[1], EXPECTED_FILES[2], EXPECTED_FILES[3]]: 
-                            print(f"Appending {part} to rom1.rom")
-                            with open(os.path.join(temp_dir, part), "rb") as f:
-                                rom1.write(f.read())
-                else:
-                    with open(os.path.join(output_folder, "rom1.rom"), "wb") as rom1:
-                        for part in [EXPECTED_FILES[0], EXPECTED_FILES[1]]: 
-                            print(f"Appending {part} to rom1.rom")
-                            with open(os.path.join(temp_dir, part), "rb") as f:
-                                rom1.write(f.read())
-                                
-                 # rom2
-                print("\nPreparing ROM 2")
-                print("---------------")   
-                if fileName != "xeviousa.zip": 
-                    with open(os.path.join(output_folder, "rom2.rom"), "wb") as rom2:
-                        for part in [EXPECTED_FILES[4],EXPECTED_FILES[5]]: 
-                            print(f"Appending {part} to rom2.rom")
-                            with open(os.path.join(temp_dir, part), "rb") as f:
-                                rom2.write(f.read())          
-                else:
-                    with open(os.path.join(output_folder, "rom2.rom"), "wb") as rom2:
-                        for part in [EXPECTED_FILES[2]]: 
-                            print(f"Copying {part} to rom2.rom")
-                            with open(os.path.join(temp_dir, part), "rb") as f:
-                                rom2.write(f.read())          
-                            
-                # rom3
-                print("\nCopying ROM 3")
-                print("-------------")
-                if fileName != "xeviousa.zip": 
-                    for filename in [EXPECTED_FILES[6]]:
-                        print(f"Copying {filename} to output folder")
-                        shutil.copy(os.path.join(temp_dir, filename), output_folder)
-                else:
-                    for filename in [EXPECTED_FILES[3]]:
-                        print(f"Copying {filename} to output folder")
-                        shutil.copy(os.path.join(temp_dir, filename), output_folder)
-                            
-                 # foreground tiles
-                print("\nCopying foreground tiles")
-                print("------------------------")
-                if fileName != "xeviousa.zip": 
-                    for filename in [EXPECTED_FILES[7]]:
-                        print(f"Copying {filename} to output folder")
-                        shutil.copy(os.path.join(temp_dir, filename), output_folder)
-                else:
-                    for filename in [EXPECTED_FILES[4]]:
-                        print(f"Copying {filename} to output folder")
-                        shutil.copy(os.path.join(temp_dir, filename), output_folder)
-                    
-                # background tiles
-                print("\nCopying background tiles")
-                print("------------------------")
-                if fileName != "xeviousa.zip": 
-                    for filename in [EXPECTED_FILES[8], EXPECTED_FILES[9]]:
-                        print(f"Copying {filename} to output folder")
-                        shutil.copy(os.path.join(temp_dir, filename), output_folder)
-                else:
-                    for filename in [EXPECTED_FILES[5], EXPECTED_FILES[6]]:
-                        print(f"Copying {filename} to output folder")
-                        shutil.copy(os.path.join(temp_dir, filename), output_folder)
-                    
-                # preparing sprites
-                print("\nPreparing sprites")
-                print("------------------------")
-                if fileName != "xeviousa.zip": 
-                    for filename in [EXPECTED_FILES[10],EXPECTED_FILES[11],EXPECTED_FILES[12]]:
-                        print(f"Copying {filename} to output folder")
-                        shutil.copy(os.path.join(temp_dir, filename), output_folder)
-                else:
-                    for filename in [EXPECTED_FILES[7],EXPECTED_FILES[8],EXPECTED_FILES[9]]:
-                        print(f"Copying {filename} to output folder")
-                        shutil.copy(os.path.join(temp_dir, filename), output_folder)
-                    
-                # Split and copy binary files within the temporary directory
-                if fileName != "xeviousa.zip": 
-                    input_file = os.path.join(temp_dir, EXPECTED_FILES[13])
-                else:
-                    input_file = os.path.join(temp_dir, EXPECTED_FILES[10])
-                split_and_copy_binary_file(input_file, 'xvi_18.4r_1', 'xvi_18.4r_2', output_folder,temp_dir)
-                    
-                # background tile maps
-                print("\nCopying background tile maps")
-                print("----------------------------")
-                if fileName != "xeviousa.zip": 
-                    for filename in [EXPECTED_FILES[14], EXPECTED_FILES[15],EXPECTED_FILES[16]]:
-                        print(f"Copying {filename} to output folder")
-                        shutil.copy(os.path.join(temp_dir, filename), output_folder)
-                else:
-                    for filename in [EXPECTED_FILES[11], EXPECTED_FILES[12],EXPECTED_FILES[13]]:
-                        print(f"Copying {filename} to output folder")
-                        shutil.copy(os.path.join(temp_dir, filename), output_folder)
-                        
-                print("\nFiles extracted and merged successfully.")
-                print("Cleaning up temporary files...")
-                
-                # MCU
-                print("\nCopying MCUs")
-                print("------------")
-                if fileName != "xeviousa.zip": 
-                    for filename in [EXPECTED_FILES[17], EXPECTED_FILES[18],EXPECTED_FILES[19]]:
-                        print(f"Copying {filename} to output folder")
-                        shutil.copy(os.path.join(temp_dir, filename), output_folder)
+    try:
+        if args.import_dat:
+            import_dat(args.rom_zip_path, ROMSET_DB_FILE)
+        elif args.audit:
+            audit(args.rom_zip_path, ROMSET_DB_FILE)
+        elif args.make_block_table:
+            make_block_table(args.rom_zip_path, BLOCK_TABLE_FILE)
+        elif args.watch:
+            run_watch(args.rom_zip_path, args.output_folder, max(1, args.jobs), args.targets, args.status_file,
+                      args.status_port, args.debounce, args.reverify, args.cache_file, args.force)
+        elif args.batch:
+            if not run_batch(args.rom_zip_path, args.output_folder, max(1, args.jobs), args.reverify, args.cache_file,
+                             args.variant, args.force, args.report):
+                sys.exit(1)
+        else:
+            report = InstallReport()
+            with contextlib.redirect_stdout(io.StringIO()) if args.quiet else contextlib.nullcontext():
+                if args.all_variants:
+                    install_all(args.rom_zip_path, args.output_folder, args.reverify, args.cache_file, args.force, report)
+                elif args.image:
+                    install_image(args.rom_zip_path, args.image, args.image_size and args.image_size * 1024 * 1024,
+                                  args.image_offset, args.reverify, args.cache_file, args.variant, report, args.format_image)
                 else:
-                    for filename in [EXPECTED_FILES[14], EXPECTED_FILES[15],EXPECTED_FILES[16]]:
-                        print(f"Copying {filename} to output folder")
-                        shutil.copy(os.path.join(temp_dir, filename), output_folder)
-                            
-                print("\nFiles extracted and merged successfully.")
-                print("Cleaning up temporary files...")
-                
-                #Create the xevcfg file
-                print("\nCreating xevcfg file")
-               
-                output_file_path = os.path.join(output_folder, "xevcfg")
-                with open(output_file_path, "wb") as binary_file:
-                    binary_file.write(bytes([0xff]) * 99)
-          
-
-        except FileNotFoundError:
-                    print(f"Error: ZIP file not found: {rom_zip_path}")
-                    sys.exit(1)
-        except zipfile.BadZipFile:
-                    print(f"Error: Invalid or corrupted ZIP file: {rom_zip_path}")
-                    sys.exit(1)
+                    install(args.rom_zip_path, args.output_folder, args.reverify, args.cache_file, args.variant, args.force, report)
+            if args.report == "json":
+                print(json.dumps(report.as_dict(), indent=1))
+            elif args.report == "summary":
+                print(report.summary())
+    except InstallError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()